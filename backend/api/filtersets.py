@@ -1,6 +1,8 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import filters, FilterSet
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -11,6 +13,10 @@ class IngredientFilter(FilterSet):
         fields = ('name', )
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
+
+
 class RecipeFilterSet(FilterSet):
     """Фильтр для рецептов"""
     tags = filters.ModelMultipleChoiceFilter(
@@ -23,6 +29,11 @@ class RecipeFilterSet(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    cooking_time = filters.RangeFilter()
+    created_at = filters.DateTimeFromToRangeFilter()
+    ingredients = NumberInFilter(method='filter_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
 
     class Meta:
         model = Recipe
@@ -30,15 +41,39 @@ class RecipeFilterSet(FilterSet):
             'author',
             'tags',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search',
+            'cooking_time',
+            'created_at',
+            'ingredients',
+            'exclude_ingredients'
         )
 
     def filter_is_favorited(self, recipes, name, value):
         if self.request.user.is_authenticated and value:
-            return recipes.filter(favorites__user=self.request.user)
+            return recipes.filter(is_favorited=True)
         return recipes
 
     def filter_is_in_shopping_cart(self, recipes, name, value):
         if self.request.user.is_authenticated and value:
-            return recipes.filter(shoppingcarts__user=self.request.user)
+            return recipes.filter(is_in_shopping_cart=True)
         return recipes
+
+    def filter_search(self, recipes, name, value):
+        return search_recipes(recipes, value)
+
+    @staticmethod
+    def has_ingredients(ingredient_ids):
+        return Exists(RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk'), ingredient_id__in=ingredient_ids
+        ))
+
+    def filter_ingredients(self, recipes, name, value):
+        """Рецепты, в которые входят все перечисленные продукты"""
+        for ingredient_id in set(value):
+            recipes = recipes.filter(self.has_ingredients([ingredient_id]))
+        return recipes
+
+    def filter_exclude_ingredients(self, recipes, name, value):
+        """Рецепты без перечисленных продуктов"""
+        return recipes.filter(~self.has_ingredients(value))
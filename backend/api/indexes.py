@@ -0,0 +1,195 @@
+import threading
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+from django.dispatch import receiver
+
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient, RecipeIngredient
+from recipes.signals import (
+    RECIPE_INGREDIENTS_VERSION, recipe_ingredients_changed
+)
+from recipes.versions import get_version, get_version_counter
+
+
+def normalize_name(name):
+    return unicodedata.normalize('NFKC', name).casefold()
+
+
+class IngredientPrefixIndex:
+    """Индекс названий ингредиентов в памяти процесса для поиска по префиксу.
+
+    Хранит отсортированные нормализованные названия и готовые
+    представления ингредиентов. Строится при первом обращении
+    и перестраивается при смене версии ингредиентов.
+    """
+    version_name = 'ingredients'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.entries = ([], [])
+
+    def build(self, version):
+        ingredients = sorted(
+            IngredientSerializer(Ingredient.objects.all(), many=True).data,
+            key=lambda ingredient: (normalize_name(ingredient['name']),
+                                    ingredient['name'], ingredient['id'])
+        )
+        self.entries = (
+            [normalize_name(ingredient['name']) for ingredient in ingredients],
+            ingredients
+        )
+        self.version = version
+
+    def search(self, prefix, version=None):
+        if version is None:
+            version = get_version(self.version_name)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.build(version)
+        keys, ingredients = self.entries
+        prefix = normalize_name(prefix)
+        return ingredients[
+            bisect_left(keys, prefix):bisect_left(keys, prefix + '\U0010ffff')
+        ]
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс состава рецептов в памяти процесса.
+
+    Для каждого продукта хранит отсортированный массив позиций
+    рецептов, в которые он входит, для каждой позиции - id рецепта
+    и число его продуктов. Строится целиком при первом обращении
+    и при смене версии состава в другом процессе, изменения
+    из текущего процесса применяются к индексу точечно. Версия
+    состава - счетчик в БД, чтобы процессы не получили одну версию.
+    """
+    version_name = RECIPE_INGREDIENTS_VERSION
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.recipe_ids = np.empty(0, dtype=np.int64)
+        self.sizes = np.empty(0, dtype=np.int32)
+        self.slots = {}
+        self.postings = {}
+        self.recipe_ingredients = {}
+
+    def build(self, version):
+        pairs = np.array(
+            RecipeIngredient.objects.order_by().values_list(
+                'recipe_id', 'ingredient_id'
+            ),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        recipe_ids, slots = np.unique(pairs[:, 0], return_inverse=True)
+        slots = slots.astype(np.int32)
+        self.recipe_ids = recipe_ids
+        self.sizes = np.bincount(slots, minlength=len(recipe_ids)).astype(
+            np.int32
+        )
+        self.slots = dict(zip(recipe_ids.tolist(), range(len(recipe_ids))))
+        self.postings = self.group(pairs[:, 1], slots)
+        self.recipe_ingredients = self.group(slots, pairs[:, 1])
+        self.version = version
+
+    @staticmethod
+    def group(keys, values):
+        """Словарь {ключ: отсортированный массив значений}"""
+        order = np.lexsort((values, keys))
+        keys, values = keys[order], values[order]
+        unique_keys, starts = np.unique(keys, return_index=True)
+        return dict(zip(unique_keys.tolist(), np.split(values, starts[1:])))
+
+    def refresh(self):
+        version = get_version_counter(self.version_name)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.build(version)
+
+    def update(self, recipe_ids, previous_version, version):
+        """Точечное обновление состава рецептов recipe_ids.
+
+        Если индекс не видел предыдущую версию, он перестроится
+        целиком при следующем поиске.
+        """
+        with self.lock:
+            if self.version != previous_version:
+                return
+            ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('recipe_id', 'ingredient_id'):
+                ingredients[recipe_id].append(ingredient_id)
+            for recipe_id, ingredient_ids in ingredients.items():
+                self.set_recipe_ingredients(recipe_id, ingredient_ids)
+            self.version = version
+
+    def set_recipe_ingredients(self, recipe_id, ingredient_ids):
+        slot = self.slots.get(recipe_id)
+        if slot is None:
+            if not ingredient_ids:
+                return
+            slot = self.slots[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids = np.append(self.recipe_ids, recipe_id)
+            self.sizes = np.append(self.sizes, np.int32(0))
+        old = set(self.recipe_ingredients.pop(slot, np.empty(0)).tolist())
+        new = set(ingredient_ids)
+        for ingredient_id in old - new:
+            slots = self.postings[ingredient_id]
+            self.postings[ingredient_id] = np.delete(
+                slots, np.searchsorted(slots, slot)
+            )
+        for ingredient_id in new - old:
+            slots = self.postings.get(
+                ingredient_id, np.empty(0, dtype=np.int32)
+            )
+            self.postings[ingredient_id] = np.insert(
+                slots, np.searchsorted(slots, slot), slot
+            )
+        if new:
+            self.recipe_ingredients[slot] = np.array(
+                sorted(new), dtype=np.int64
+            )
+        self.sizes[slot] = len(new)
+
+    def search(self, ingredient_ids, max_missing=0):
+        """Рецепты, которым не хватает не более max_missing продуктов.
+
+        Возвращает массивы id рецептов, числа имеющихся и недостающих
+        продуктов, упорядоченные по возрастанию недостающих, убыванию
+        имеющихся и от новых рецептов к старым.
+        """
+        self.refresh()
+        with self.lock:
+            postings = [self.postings[ingredient_id]
+                        for ingredient_id in set(ingredient_ids)
+                        if ingredient_id in self.postings]
+            if not postings:
+                empty = np.empty(0, dtype=np.int64)
+                return empty, empty, empty
+            covered = np.bincount(
+                np.concatenate(postings), minlength=len(self.sizes)
+            )
+            missing = self.sizes - covered
+            slots = np.flatnonzero((covered > 0) & (missing <= max_missing))
+            recipe_ids = self.recipe_ids[slots]
+        covered, missing = covered[slots], missing[slots]
+        order = np.lexsort((-recipe_ids, -covered, missing))
+        return recipe_ids[order], covered[order], missing[order]
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+@receiver(recipe_ingredients_changed)
+def recipe_ingredient_index_changed(recipe_ids, previous_version, version,
+                                    **kwargs):
+    recipe_ingredient_index.update(recipe_ids, previous_version, version)
@@ -0,0 +1,148 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.scenarios import (
+    get_client, get_scenarios, run_scenario, test_database
+)
+from recipes.datasets import SCALES, seed_dataset
+
+REPEAT = 20
+WARMUP = 2
+MAX_SLOWDOWN = 0.5
+MIN_SLOWDOWN_MS = 2.0
+
+
+class Command(BaseCommand):
+    """Команда для замера времени и числа запросов эндпоинтов API.
+
+    Для каждого масштаба данных создается временная тестовая БД,
+    сценарии выполняются repeat раз, для каждого сохраняются медиана
+    и 95-й перцентиль времени ответа и число SQL-запросов. Результаты
+    можно записать как базовые и сравнивать с ними последующие замеры.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, action='append',
+                            dest='scales',
+                            help='Dataset sizes to benchmark '
+                                 '(default: small)')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Benchmark only the given scenarios')
+        parser.add_argument('--repeat', type=int, default=REPEAT,
+                            help='Measured runs of every scenario')
+        parser.add_argument('--warmup', type=int, default=WARMUP,
+                            help='Unmeasured runs before measuring')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the cache between requests')
+        parser.add_argument('--save', metavar='PATH',
+                            help='Write results to a JSON baseline file')
+        parser.add_argument('--baseline', metavar='PATH',
+                            help='Compare results with a JSON baseline')
+        parser.add_argument('--max-slowdown', type=float,
+                            default=MAX_SLOWDOWN,
+                            help='Allowed relative growth of the median '
+                                 'time, 0.5 means 50%%')
+        parser.add_argument('--min-slowdown-ms', type=float,
+                            default=MIN_SLOWDOWN_MS,
+                            help='Ignore slowdowns smaller than this')
+        parser.add_argument('--query-slack', type=int, default=0,
+                            help='Allowed growth of the query count')
+
+    def handle(self, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть не меньше 1')
+        results = {'vendor': connection.vendor, 'scales': {}}
+        for scale in options['scales'] or ('small',):
+            self.stdout.write(f'Масштаб {scale}: {SCALES[scale]}')
+            with test_database():
+                results['scales'][scale] = self.benchmark(scale, options)
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["save"]}')
+        if options['baseline']:
+            self.compare(results, options)
+
+    def benchmark(self, scale, options):
+        dataset = seed_dataset(scale)
+        scenarios = [
+            scenario for scenario in get_scenarios(dataset)
+            if not options['scenarios']
+            or scenario.name in options['scenarios']
+        ]
+        clients = {scenario.name: get_client(dataset, scenario)
+                   for scenario in scenarios}
+        durations = {scenario.name: [] for scenario in scenarios}
+        queries = dict.fromkeys(durations, 0)
+        # Сценарии выполняются по кругу, чтобы добавление в избранное,
+        # корзину и подписка чередовались с их отменой.
+        for run in range(options['warmup'] + options['repeat']):
+            for scenario in scenarios:
+                result = run_scenario(
+                    clients[scenario.name], scenario,
+                    clear_cache=not options['warm_cache']
+                )
+                if result.status_code >= 400:
+                    raise CommandError(
+                        f'{scenario.name}: ответ {result.status_code}'
+                    )
+                if run >= options['warmup']:
+                    durations[scenario.name].append(result.duration * 1000)
+                    queries[scenario.name] = max(
+                        queries[scenario.name], len(result.queries)
+                    )
+        measurements = {}
+        for name, times in durations.items():
+            times.sort()
+            measurements[name] = {
+                'median_ms': round(statistics.median(times), 3),
+                'p95_ms': round(times[int(0.95 * (len(times) - 1))], 3),
+                'queries': queries[name],
+            }
+            self.stdout.write(
+                '  {name}: {median_ms} мс (p95 {p95_ms} мс), '
+                'запросов {queries}'.format(name=name, **measurements[name])
+            )
+        return measurements
+
+    def compare(self, results, options):
+        """Сравнение с базовыми результатами, ошибка при регрессии"""
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Ошибка чтения базовых результатов: {error}')
+        if baseline.get('vendor') != results['vendor']:
+            self.stdout.write(self.style.WARNING(
+                f'Базовые результаты получены на {baseline.get("vendor")}, '
+                f'текущие - на {results["vendor"]}'
+            ))
+        regressions = []
+        for scale, measurements in results['scales'].items():
+            for name, current in measurements.items():
+                expected = baseline.get('scales', {}).get(scale, {}).get(name)
+                if expected is None:
+                    continue
+                if current['queries'] > (
+                    expected['queries'] + options['query_slack']
+                ):
+                    regressions.append(
+                        f'{scale}/{name}: запросов {current["queries"]}, '
+                        f'было {expected["queries"]}'
+                    )
+                slowdown = current['median_ms'] - expected['median_ms']
+                if (slowdown > options['min_slowdown_ms']
+                        and current['median_ms'] > expected['median_ms'] * (
+                            1 + options['max_slowdown'])):
+                    regressions.append(
+                        f'{scale}/{name}: {current["median_ms"]} мс, '
+                        f'было {expected["median_ms"]} мс'
+                    )
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
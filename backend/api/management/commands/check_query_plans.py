@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.query_plans import LARGE_TABLE_ROWS, check_query, get_table_sizes
+from api.scenarios import (
+    get_client, get_scenarios, run_scenario, test_database
+)
+from recipes.datasets import SCALES, seed_dataset
+
+
+class Command(BaseCommand):
+    """Команда для проверки планов SQL-запросов эндпоинтов API.
+
+    Во временной тестовой БД создается набор данных, запросы
+    сценариев выполняются через API, а их SELECT-запросы проверяются
+    через EXPLAIN на полный просмотр больших таблиц и сортировку
+    без индекса. Для каждой проблемы предлагается индекс.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small',
+                            help='Size of the generated dataset')
+        parser.add_argument('--min-rows', type=int,
+                            default=LARGE_TABLE_ROWS,
+                            help='Tables with at least this many rows '
+                                 'must not be scanned, sorted '
+                                 'or de-duplicated')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Check only the given scenarios')
+        parser.add_argument('--warn-only', action='store_true',
+                            help='Report problems without failing')
+
+    def handle(self, **options):
+        with test_database():
+            problems = self.check_scenarios(options)
+        suggestions = sorted({problem.suggestion for problem in problems
+                              if problem.suggestion})
+        if suggestions:
+            self.stdout.write('Предлагаемые индексы:')
+            for suggestion in suggestions:
+                self.stdout.write(f'  {suggestion}')
+        if problems and not options['warn_only']:
+            raise CommandError(f'Проблем в планах запросов: {len(problems)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверка планов завершена, проблем: {len(problems)}'
+        ))
+
+    def check_scenarios(self, options):
+        dataset = seed_dataset(options['scale'])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        table_sizes = get_table_sizes()
+        problems = []
+        for scenario in get_scenarios(dataset):
+            if options['scenarios'] and (
+                scenario.name not in options['scenarios']
+            ):
+                continue
+            result = run_scenario(get_client(dataset, scenario), scenario)
+            if result.status_code >= 400:
+                raise CommandError(
+                    f'{scenario.name}: ответ {result.status_code}'
+                )
+            found = {}
+            for query in result.queries:
+                for problem in check_query(
+                    query['sql'], table_sizes, options['min_rows']
+                ):
+                    if problem.kind not in scenario.allow:
+                        found.setdefault(
+                            (problem.kind, problem.table, problem.suggestion),
+                            problem
+                        )
+            self.stdout.write(
+                f'{scenario.name}: запросов {len(result.queries)}, '
+                f'проблем {len(found)}'
+            )
+            for problem in found.values():
+                self.stdout.write(self.style.WARNING(
+                    f'  {problem.kind} {problem.table}: {problem.detail}'
+                ))
+                if problem.suggestion:
+                    self.stdout.write(f'    индекс: {problem.suggestion}')
+            problems.extend(found.values())
+        return problems
@@ -0,0 +1,204 @@
+import json
+import logging
+import re
+import sys
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.fields import Field
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+logger = logging.getLogger(__name__)
+
+request_metrics = ContextVar('request_metrics', default=None)
+
+PLACEHOLDERS = re.compile(r'%s(?:, %s)+')
+NUMBERS = re.compile(r'\b\d+\b')
+FIELD_METHODS = ('to_representation', 'get_attribute')
+
+
+@lru_cache(maxsize=1024)
+def get_sql_shape(sql):
+    """SQL-запрос без различий в числе параметров IN и в числах"""
+    return NUMBERS.sub('N', PLACEHOLDERS.sub('%s', sql))
+
+
+def get_field_path(field):
+    """Имя поля вида RecipeGetSerializer.author.is_subscribed"""
+    names = []
+    while field.parent is not None:
+        if field.field_name:
+            names.append(field.field_name)
+        field = field.parent
+    if isinstance(field, ListSerializer):
+        field = field.child
+    return '.'.join([type(field).__name__, *reversed(names)])
+
+
+def find_serializer_field():
+    """Поле сериализатора, при обработке которого выполняется запрос"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name in FIELD_METHODS:
+            field = frame.f_locals.get('self')
+            if isinstance(field, Field):
+                return get_field_path(field)
+        frame = frame.f_back
+    return None
+
+
+class RequestMetrics:
+    """Запросы к БД и время этапов обработки одного запроса к API"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.render_time = 0.0
+        self.render_started = None
+        self.serializing = False
+        self.shapes = {}
+        self.repeated = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL для connection.execute_wrapper"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            shape = get_sql_shape(sql)
+            count = self.shapes[shape] = self.shapes.get(shape, 0) + 1
+            # Стек просматривается один раз для каждого повторяющегося
+            # запроса, остальные запросы обходятся без этого.
+            if count == settings.SERVER_TIMING_N_PLUS_ONE_THRESHOLD + 1:
+                self.repeated[shape] = find_serializer_field()
+
+    def get_n_plus_one(self):
+        return [{'sql': shape, 'count': self.shapes[shape], 'field': field}
+                for shape, field in self.repeated.items()]
+
+
+def instrument_serializers():
+    """Замер времени сериализации в BaseSerializer.data.
+
+    Учитываются только внешние сериализаторы, время запросов
+    к БД во время сериализации в него не входит.
+    """
+    data = BaseSerializer.data.fget
+    if getattr(data, 'instrumented', False):
+        return
+
+    def timed_data(serializer):
+        metrics = request_metrics.get()
+        if metrics is None or metrics.serializing:
+            return data(serializer)
+        metrics.serializing = True
+        started, db_time = time.perf_counter(), metrics.db_time
+        try:
+            return data(serializer)
+        finally:
+            metrics.serializing = False
+            metrics.serializer_time += (
+                time.perf_counter() - started
+                - (metrics.db_time - db_time)
+            )
+
+    timed_data.instrumented = True
+    BaseSerializer.data = property(timed_data)
+
+
+def format_duration(seconds):
+    return round(seconds * 1000, 3)
+
+
+class ServerTimingMiddleware:
+    """Middleware замеров запросов к API.
+
+    Для каждого запроса с путем из SERVER_TIMING_PATH_PREFIX
+    считаются запросы к БД и время работы БД, сериализации
+    и рендеринга ответа. Замеры отдаются в заголовке Server-Timing
+    и записываются в лог одной JSON-строкой. Запросы с одинаковым
+    SQL, повторенные больше SERVER_TIMING_N_PLUS_ONE_THRESHOLD раз,
+    записываются в лог как вероятные N+1 вместе с вью и полем
+    сериализатора, которое их выполняет.
+
+    Middleware должен быть последним в MIDDLEWARE, чтобы время
+    рендеринга заканчивалось вместе с обработкой запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        if not request.path.startswith(settings.SERVER_TIMING_PATH_PREFIX):
+            return self.get_response(request)
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        total = time.perf_counter() - metrics.started
+        if metrics.render_started is not None:
+            metrics.render_time = time.perf_counter() - metrics.render_started
+        response['Server-Timing'] = self.get_header(metrics, total)
+        self.log(request, response, metrics, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = request_metrics.get()
+        if metrics is not None:
+            view = getattr(view_func, 'cls', view_func)
+            action = getattr(view_func, 'actions', {}).get(
+                request.method.lower()
+            )
+            metrics.view = '.'.join(
+                name for name in (view.__name__, action) if name
+            )
+
+    def process_template_response(self, request, response):
+        metrics = request_metrics.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+        return response
+
+    @staticmethod
+    def get_header(metrics, total):
+        return ', '.join((
+            f'db;dur={format_duration(metrics.db_time)};'
+            f'desc="{metrics.queries} queries"',
+            f'serialize;dur={format_duration(metrics.serializer_time)}',
+            f'render;dur={format_duration(metrics.render_time)}',
+            f'total;dur={format_duration(total)}',
+        ))
+
+    @staticmethod
+    def log(request, response, metrics, total):
+        n_plus_one = metrics.get_n_plus_one()
+        logger.log(
+            logging.WARNING if n_plus_one else logging.INFO,
+            json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'view': metrics.view,
+                'queries': metrics.queries,
+                'db_ms': format_duration(metrics.db_time),
+                'serialize_ms': format_duration(metrics.serializer_time),
+                'render_ms': format_duration(metrics.render_time),
+                'total_ms': format_duration(total),
+                'n_plus_one': n_plus_one,
+            }, ensure_ascii=False)
+        )
@@ -1,7 +1,189 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class FoodgramCursorPaginator(pagination.BasePagination):
+    """Постраничный вывод по ключу сортировки (keyset) без COUNT(*).
+
+    Ключом служат поля сортировки queryset'а, дополненные id объекта,
+    например (created_at, id) для рецептов. Курсор содержит значения
+    ключа крайнего объекта страницы и направление перехода.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = getattr(settings, 'PAGE_SIZE', 6)
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        position, self.reverse = self.decode_cursor(request)
+        ordering = (self.invert_ordering(self.ordering) if self.reverse
+                    else self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_position_filter(ordering, position)
+            )
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return pagination._positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by
+                        or queryset.model._meta.ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not {pk_name, 'pk'} & {field.lstrip('-') for field in ordering}:
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return tuple(ordering)
+
+    @staticmethod
+    def invert_ordering(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}'
+                     for field in ordering)
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """Условие "после позиции" для лексикографического порядка ключа"""
+        position_filter = Q()
+        equal_fields = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            position_filter |= Q(
+                **equal_fields, **{f'{name}__{lookup}': value}
+            )
+            equal_fields[name] = value
+        return position_filter
+
+    def get_model_field(self, name):
+        try:
+            return self.model._meta.get_field(
+                self.model._meta.pk.name if name == 'pk' else name
+            )
+        except FieldDoesNotExist:
+            return None
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            model_field = self.get_model_field(name)
+            position.append(
+                model_field.value_to_string(instance) if model_field
+                else getattr(instance, name)
+            )
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = [
+                model_field.to_python(value) if model_field else value
+                for model_field, value in zip(
+                    (self.get_model_field(field.lstrip('-'))
+                     for field in self.ordering),
+                    cursor['p']
+                )
+            ]
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return position, bool(cursor.get('r'))
+        except (binascii.Error, KeyError, TypeError,
+                ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        cursor = json.dumps(
+            {'p': self.get_position(instance), 'r': int(reverse)},
+            separators=(',', ':')
+        )
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            base64.urlsafe_b64encode(cursor.encode()).decode()
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+        return self.encode_cursor(self.page[0], reverse=True)
 
 
 class FoodgramPaginator(pagination.PageNumberPagination):
+    """Постраничный вывод по номеру страницы.
+
+    Запросы с параметром cursor (и без page) обслуживаются
+    FoodgramCursorPaginator.
+    """
     page_size_query_param = 'limit'
     page_size = getattr(settings, 'PAGE_SIZE', 6)
+    cursor_paginator_class = FoodgramCursorPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if (self.cursor_paginator_class.cursor_query_param
+                in request.query_params
+                and self.page_query_param not in request.query_params
+                and isinstance(queryset, QuerySet)):
+            self.cursor_paginator = self.cursor_paginator_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
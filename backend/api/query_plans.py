@@ -0,0 +1,194 @@
+import json
+import re
+from collections import namedtuple
+
+from django.apps import apps
+from django.db import connection
+
+LARGE_TABLE_ROWS = 1000
+SEQ_SCAN = 'seq_scan'
+SORT = 'sort'
+DISTINCT = 'distinct'
+
+Problem = namedtuple('Problem', ('kind', 'table', 'detail', 'suggestion'))
+
+ALIAS = re.compile(r'"(\w+)"(?: AS)? "?([A-Z]\d+)"?(?=[\s),])')
+ORDER_BY = re.compile(r'\bORDER BY\b(?!.*\bORDER BY\b)(.*)$', re.S)
+LIMIT = re.compile(r'\bLIMIT \d+(?: OFFSET \d+)?\s*$')
+LITERAL = r"(?:-?\d|'|true\b|false\b)"
+COLUMN = r'(?:"{ref}"|{ref})\."(\w+)"'
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)$')
+SELECT_DISTINCT = re.compile(r'\s*SELECT DISTINCT\b')
+FROM_TABLE = re.compile(r'\bFROM "(\w+)"(?! "?[A-Z]\d)')
+
+
+def get_models_by_table():
+    return {model._meta.db_table: model
+            for model in apps.get_models(include_auto_created=True)}
+
+
+def get_table_sizes():
+    """Количество строк в таблицах моделей проекта"""
+    return {table: model._base_manager.count()
+            for table, model in get_models_by_table().items()
+            if model._meta.managed}
+
+
+def get_aliases(sql):
+    """Соответствие псевдонимов таблиц в запросе (U0, T3) их именам"""
+    aliases = {table: table for table in get_models_by_table()}
+    for table, alias in ALIAS.findall(sql):
+        aliases[alias] = aliases[alias.lower()] = table
+    return aliases
+
+
+def get_columns(sql, table, aliases):
+    """Столбцы table из сравнений с константами и из ORDER BY запроса"""
+    refs = '|'.join(re.escape(ref) for ref, name in aliases.items()
+                    if name == table)
+    column = COLUMN.format(ref=f'(?:{refs})')
+    filtered = []
+    for name in re.findall(
+        rf'{column} (?:= {LITERAL}|IN \({LITERAL})', sql
+    ):
+        if name not in filtered:
+            filtered.append(name)
+    ordered = []
+    order_by = ORDER_BY.search(sql)
+    if order_by:
+        for name, direction in re.findall(
+            rf'{column}(?: (ASC|DESC))?', order_by.group(1)
+        ):
+            ordered.append(('-' if direction == 'DESC' else '') + name)
+    return filtered, ordered
+
+
+def get_indexed_fields(model):
+    """Наборы полей существующих индексов модели без направлений"""
+    indexed = [(field.name,) for field in model._meta.concrete_fields
+               if field.db_index or field.unique]
+    indexed += [tuple(name.lstrip('-') for name in index.fields)
+                for index in model._meta.indexes]
+    indexed += [tuple(constraint.fields)
+                for constraint in model._meta.constraints
+                if getattr(constraint, 'fields', None)]
+    indexed += [tuple(fields) for fields in model._meta.unique_together]
+    return indexed
+
+
+def get_index_fields(sql, table, aliases):
+    """Поля индекса по столбцам условий и сортировки: (field, -field)"""
+    model = get_models_by_table()[table]
+    fields = {field.column: field.name
+              for field in model._meta.concrete_fields}
+    filtered, ordered = get_columns(sql, table, aliases)
+    names = [fields.get(column, column) for column in filtered]
+    for column in ordered:
+        name = fields.get(column.lstrip('-'), column.lstrip('-'))
+        if name not in names:
+            names.append(('-' if column.startswith('-') else '') + name)
+    return model, names
+
+
+def suggest_index(sql, table, aliases):
+    """Недостающий индекс для запроса в виде Model(field, -field).
+
+    Возвращает None, если такого индекса не вывести или он уже есть.
+    """
+    model, names = get_index_fields(sql, table, aliases)
+    key = tuple(name.lstrip('-') for name in names)
+    if not names or any(fields[:len(key)] == key
+                        for fields in get_indexed_fields(model)):
+        return None
+    return f'{model.__name__}({", ".join(names)})'
+
+
+def get_order_table(sql, aliases):
+    order_by = ORDER_BY.search(sql)
+    if not order_by:
+        return None
+    reference = re.search(r'"?(\w+)"?\."\w+"', order_by.group(1))
+    return reference and aliases.get(reference.group(1))
+
+
+def explain_sqlite(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        details = [row[3] for row in cursor.fetchall()]
+    scans = [match.group(1) for match in map(SQLITE_SCAN.match, details)
+             if match]
+    sorts = [detail for detail in details
+             if detail == 'USE TEMP B-TREE FOR ORDER BY']
+    distincts = [detail for detail in details
+                 if detail == 'USE TEMP B-TREE FOR DISTINCT']
+    return details, scans, sorts, distincts
+
+
+def explain_postgresql(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = [plan[0]['Plan']]
+    details, scans, sorts, distincts = [], [], [], []
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get('Plans', ()))
+        if node['Node Type'] == 'Seq Scan':
+            details.append(f'Seq Scan on {node["Relation Name"]}')
+            scans.append(node['Relation Name'])
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            details.append(f'Sort by {", ".join(node["Sort Key"])}')
+            sorts.append(details[-1])
+        elif node['Node Type'] in ('Unique', 'HashAggregate') and (
+            SELECT_DISTINCT.match(sql)
+        ):
+            details.append(node['Node Type'])
+            distincts.append(details[-1])
+    return details, scans, sorts, distincts
+
+
+EXPLAINERS = {
+    'sqlite': explain_sqlite,
+    'postgresql': explain_postgresql,
+}
+
+
+def check_query(sql, table_sizes, min_rows=LARGE_TABLE_ROWS):
+    """Проблемы плана SELECT-запроса.
+
+    Проблемой считается полный просмотр таблицы, в которой не меньше
+    min_rows строк, и сортировка строк такой таблицы перед LIMIT -
+    выбор страницы из всех подходящих строк, - если подходящего
+    для сортировки индекса нет. Если индекс есть, сортировку
+    выбрал планировщик, потому что условие запроса избирательнее.
+    Проблемой считается и удаление повторов (DISTINCT) строк
+    такой таблицы, обычно после соединения со связанными таблицами.
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return []
+    details, scans, sorts, distincts = EXPLAINERS[connection.vendor](sql)
+    aliases = get_aliases(sql)
+    problems = []
+    for name in scans:
+        table = aliases.get(name, name)
+        if table_sizes.get(table, 0) >= min_rows:
+            problems.append(Problem(
+                SEQ_SCAN, table, '; '.join(details),
+                suggest_index(sql, table, aliases)
+            ))
+    table = FROM_TABLE.search(sql)
+    table = table and table.group(1)
+    if distincts and table_sizes.get(table, 0) >= min_rows:
+        problems.append(Problem(DISTINCT, table, '; '.join(details), None))
+    table = get_order_table(sql, aliases)
+    if sorts and LIMIT.search(sql) and (
+        table_sizes.get(table, 0) >= min_rows
+    ):
+        suggestion = suggest_index(sql, table, aliases)
+        if suggestion:
+            problems.append(Problem(
+                SORT, table, '; '.join(details), suggestion
+            ))
+    return problems
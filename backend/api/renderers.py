@@ -0,0 +1,33 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """Рендерер формата файла списка покупок.
+
+    Сами файлы формируются во вьюсете, рендерер позволяет выбрать
+    формат параметром format и отображает ошибки в виде JSON.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class TxtRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CsvRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PdfRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
@@ -0,0 +1,196 @@
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (
+    CaptureQueriesContext, override_settings,
+    setup_test_environment, teardown_test_environment
+)
+from rest_framework.test import APIClient
+
+from recipes.models import (
+    Favorite, FoodgramUser, Follow, RecipeIngredient, ShoppingCart
+)
+from recipes.versions import VERSIONS_CACHE
+
+Scenario = namedtuple(
+    'Scenario', ('name', 'method', 'path', 'authenticated', 'allow')
+)
+Result = namedtuple('Result', ('status_code', 'queries', 'duration'))
+
+SORT = 'sort'
+DISTINCT = 'distinct'
+ADMIN = 'admin'
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'scenarios',
+    },
+    VERSIONS_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'scenarios-versions',
+        'TIMEOUT': None,
+    },
+}
+
+
+@contextmanager
+def test_database():
+    """Временная тестовая БД и локальный кэш для запуска сценариев"""
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        with override_settings(CACHES=TEST_CACHES, JOBS_RUN_EAGERLY=False):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def get_scenarios(dataset):
+    """Запросы к API для проверки планов и замеров.
+
+    Пути строятся по данным seed_dataset: действия выполняются
+    от имени первого пользователя, добавление в избранное, корзину
+    и подписка - для объектов, которых у него еще нет, и отменяются
+    следующим запросом. Страницы админки открываются от имени
+    последнего пользователя, он становится суперпользователем.
+    allow перечисляет допустимые в планах проблемы, например
+    сортировку по релевантности поиска или удаление повторов
+    рецептов с несколькими выбранными тегами.
+    """
+    user_id = dataset['user_ids'][0]
+    recipe_id = dataset['recipe_ids'][0]
+    author_id = FoodgramUser.objects.filter(recipes__id=recipe_id).get().id
+    # Самые частые продукты одного рецепта, чтобы фильтр по всем
+    # продуктам возвращал непустую страницу.
+    ingredient_ids = ','.join(map(str, RecipeIngredient.objects.filter(
+        recipe_id=recipe_id
+    ).annotate(
+        uses=Count('ingredient__recipeingredients')
+    ).order_by('-uses', 'ingredient_id').values_list(
+        'ingredient_id', flat=True
+    )[:3]))
+    new_recipe_id = next(
+        recipe_id for recipe_id in dataset['recipe_ids']
+        if not Favorite.objects.filter(
+            user_id=user_id, recipe_id=recipe_id
+        ).exists() and not ShoppingCart.objects.filter(
+            user_id=user_id, recipe_id=recipe_id
+        ).exists()
+    )
+    new_author_id = next(
+        author_id for author_id in dataset['user_ids'][1:]
+        if not Follow.objects.filter(
+            user_id=user_id, author_id=author_id
+        ).exists()
+    )
+    return [
+        Scenario('recipe_list_anonymous', 'get', '/api/recipes/', False, ()),
+        Scenario('recipe_list', 'get', '/api/recipes/', True, ()),
+        Scenario('recipe_list_cursor', 'get', '/api/recipes/?cursor=',
+                 True, ()),
+        Scenario('recipe_list_tags', 'get',
+                 '/api/recipes/?tags=tag0&tags=tag1', True, (DISTINCT,)),
+        Scenario('recipe_list_author', 'get',
+                 f'/api/recipes/?author={author_id}', True, ()),
+        Scenario('recipe_list_favorited', 'get',
+                 '/api/recipes/?is_favorited=1', True, ()),
+        Scenario('recipe_list_in_shopping_cart', 'get',
+                 '/api/recipes/?is_in_shopping_cart=1', True, ()),
+        Scenario('recipe_list_cooking_time', 'get',
+                 '/api/recipes/?cooking_time_min=10&cooking_time_max=20',
+                 True, ()),
+        Scenario('recipe_list_ingredients', 'get',
+                 f'/api/recipes/?ingredients={ingredient_ids}', True, ()),
+        Scenario('recipe_list_exclude_ingredients', 'get',
+                 f'/api/recipes/?exclude_ingredients={ingredient_ids}',
+                 True, ()),
+        Scenario('recipe_search', 'get', '/api/recipes/?search=рецепт',
+                 True, (SORT,)),
+        Scenario('recipe_detail', 'get', f'/api/recipes/{recipe_id}/',
+                 True, ()),
+        Scenario('recipes_available', 'get',
+                 f'/api/recipes/available/?ingredients={ingredient_ids}'
+                 f'&max_missing=5', True, ()),
+        Scenario('favorite_add', 'post',
+                 f'/api/recipes/{new_recipe_id}/favorite/', True, ()),
+        Scenario('favorite_remove', 'delete',
+                 f'/api/recipes/{new_recipe_id}/favorite/', True, ()),
+        Scenario('shopping_cart_add', 'post',
+                 f'/api/recipes/{new_recipe_id}/shopping_cart/', True, ()),
+        Scenario('shopping_cart_remove', 'delete',
+                 f'/api/recipes/{new_recipe_id}/shopping_cart/', True, ()),
+        Scenario('download_shopping_cart', 'get',
+                 '/api/recipes/download_shopping_cart/?format=txt',
+                 True, ()),
+        Scenario('subscribe', 'post',
+                 f'/api/users/{new_author_id}/subscribe/', True, ()),
+        Scenario('unsubscribe', 'delete',
+                 f'/api/users/{new_author_id}/subscribe/', True, ()),
+        Scenario('subscriptions', 'get', '/api/users/subscriptions/',
+                 True, ()),
+        Scenario('user_list', 'get', '/api/users/', True, ()),
+        Scenario('user_detail', 'get', f'/api/users/{author_id}/',
+                 True, ()),
+        Scenario('user_me', 'get', '/api/users/me/', True, ()),
+        Scenario('ingredient_search', 'get', '/api/ingredients/?name=Прод',
+                 False, ()),
+        Scenario('tag_list', 'get', '/api/tags/', False, ()),
+        Scenario('admin_user_list', 'get', '/admin/recipes/foodgramuser/',
+                 ADMIN, ()),
+        Scenario('admin_user_list_filters', 'get',
+                 '/admin/recipes/foodgramuser/?hasrecipes=hasrecipes%3D1'
+                 '&hasfollowers=hasfollowers%3D1'
+                 '&hasfollowingauthors=hasfollowingauthors%3D0',
+                 ADMIN, ()),
+        Scenario('admin_ingredient_list_filter', 'get',
+                 '/admin/recipes/ingredient/?isinrecipes=isinrecipes%3D1',
+                 ADMIN, ()),
+        Scenario('admin_recipe_list_filters', 'get',
+                 '/admin/recipes/recipe/?cooking_time=0', ADMIN, ()),
+    ]
+
+
+def get_client(dataset, scenario):
+    client = APIClient()
+    if scenario.authenticated == ADMIN:
+        admin = FoodgramUser.objects.get(pk=dataset['user_ids'][-1])
+        admin.is_staff = admin.is_superuser = True
+        admin.save(update_fields=('is_staff', 'is_superuser'))
+        client.force_login(admin)
+    elif scenario.authenticated:
+        client.force_authenticate(
+            FoodgramUser.objects.get(pk=dataset['user_ids'][0])
+        )
+    return client
+
+
+def reset_cache():
+    """Очистка кэша. Версии данных хранятся в отдельном кэше
+    и не сбрасываются, поэтому индексы в памяти процесса
+    не перестраиваются при каждом запросе"""
+    cache.clear()
+
+
+def run_scenario(client, scenario, clear_cache=True):
+    """Выполнение запроса сценария с записью SQL-запросов и времени.
+
+    Кэш по умолчанию очищается перед запросом, чтобы в записи
+    оказались все запросы к БД.
+    """
+    if clear_cache:
+        reset_cache()
+    with CaptureQueriesContext(connection) as capture:
+        started = time.perf_counter()
+        response = getattr(client, scenario.method)(scenario.path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        duration = time.perf_counter() - started
+    return Result(response.status_code, capture.captured_queries, duration)
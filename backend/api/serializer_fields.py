@@ -1,10 +1,23 @@
 import base64
+import binascii
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
 from rest_framework import serializers
 
+from recipes.images import IMAGE_FORMATS, IMAGE_VARIANTS, get_variant_url
+
+BASE64_CHUNK_SIZE = 64 * 1024
+SPOOLED_IMAGE_SIZE = 1024 * 1024
+
 
 class GetIsFavoritedShippingCartField(serializers.BooleanField):
+    """Флаг наличия рецепта в избранном или в корзине пользователя.
+
+    Значение берется из одноименной аннотации queryset'а,
+    запрос к БД выполняется только для неаннотированного рецепта.
+    """
     def __init__(self, model):
         super().__init__()
         self.model = model
@@ -13,24 +26,80 @@ class GetIsFavoritedShippingCartField(serializers.BooleanField):
         return instance
 
     def to_representation(self, recipe):
-        return (self.context.get('request').user.is_authenticated
-                and self.model.objects.filter(
-                    user=self.context.get('request').user,
-                    recipe=recipe.id).exists()
-                )
+        user = self.context.get('request').user
+        if not user.is_authenticated:
+            return False
+        annotated = getattr(recipe, self.field_name, None)
+        if annotated is not None:
+            return annotated
+        return self.model.objects.filter(
+            user=user,
+            recipe=recipe.id).exists()
 
 
 class Base64ImageField(serializers.ImageField):
+    """Изображение в виде data URL с base64 или загруженного файла.
+
+    base64 декодируется частями во временный файл, изображения
+    больше MAX_IMAGE_UPLOAD_SIZE отклоняются.
+    """
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            header, data = data.split(';base64,')
+            header, _, data = data.partition(';base64,')
             ext = header.split('/')[-1]
-            try:
-                decoded_file = base64.b64decode(data)
-            except TypeError:
-                raise serializers.ValidationError(
-                    'Картинка не валидна'
-                )
-            data = ContentFile(decoded_file, name=f'image.{ext}')
+            # Перевод строк и пробелы допустимы в base64, но мешают
+            # делению на части кратной четырем длины.
+            data = ''.join(data.split())
+            self.check_size(len(data) // 4 * 3)
+            data = File(self.decode(data), name=f'image.{ext}')
+        elif hasattr(data, 'size'):
+            self.check_size(data.size)
         return super().to_internal_value(data)
+
+    @staticmethod
+    def check_size(size):
+        if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f'Размер изображения превышает '
+                f'{settings.MAX_IMAGE_UPLOAD_SIZE} байт'
+            )
+
+    @staticmethod
+    def decode(data):
+        decoded_file = SpooledTemporaryFile(max_size=SPOOLED_IMAGE_SIZE)
+        try:
+            for start in range(0, len(data), BASE64_CHUNK_SIZE):
+                decoded_file.write(base64.b64decode(
+                    data[start:start + BASE64_CHUNK_SIZE], validate=True
+                ))
+        except (binascii.Error, ValueError):
+            decoded_file.close()
+            raise serializers.ValidationError('Картинка не валидна')
+        decoded_file.seek(0)
+        return decoded_file
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии изображения {размер: {формат: url}}.
+
+    Пока копии не созданы, все ссылки ведут на оригинал.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, image):
+        if not image:
+            return None
+        request = self.context.get('request')
+        variants = {}
+        for size in IMAGE_VARIANTS:
+            variants[size] = {}
+            for image_format in IMAGE_FORMATS:
+                url = get_variant_url(image, size, image_format)
+                variants[size][image_format] = (
+                    request.build_absolute_uri(url) if request else url
+                )
+        return variants
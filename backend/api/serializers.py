@@ -1,30 +1,46 @@
+from collections import OrderedDict
+from hashlib import md5
+from operator import itemgetter
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Manager, prefetch_related_objects
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from rest_framework.relations import PrimaryKeyRelatedField
 
 from api.serializer_fields import (
     Base64ImageField,
-    GetIsFavoritedShippingCartField
+    GetIsFavoritedShippingCartField,
+    ImageVariantsField
 )
 from recipes.models import (
-    Ingredient, Favorite, Follow,
+    Ingredient, Favorite, Job,
     RecipeIngredient, Recipe,
-    ShoppingCart, Tag
+    ShoppingCart, ShoppingCartIngredient, Tag
 )
 from recipes.models import MIN_AMOUNT, NAME_MAX_LENGTH
+from recipes.signals import send_recipe_ingredients_changed
+from recipes.tasks import enqueue_image_deletion
+from recipes.versions import (
+    bump_version, get_versions,
+    recipe_version_name, user_version_name
+)
 
 User = get_user_model()
 
 
 class UserRepresentSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField(source='avatar')
 
     class Meta(UserSerializer.Meta):
         model = User
         fields = (
             *UserSerializer.Meta.fields,
             'avatar',
+            'avatar_variants',
             'is_subscribed'
         )
 
@@ -32,10 +48,21 @@ class UserRepresentSerializer(UserSerializer):
         user = self.context.get('request').user
         return (user.is_authenticated
                 and author != user
-                and Follow.objects.filter(
-                    user=user,
-                    author=author
-                ).exists())
+                and author.id in self.get_subscribed_author_ids(user))
+
+    def get_subscribed_author_ids(self, user):
+        """Id авторов, на которых подписан пользователь.
+
+        Загружаются одним запросом и сохраняются в контексте сериализатора,
+        общем для всех вложенных сериализаторов.
+        """
+        if 'subscribed_author_ids' not in self.context:
+            self.context['subscribed_author_ids'] = set(
+                user.subscriptions.order_by().values_list(
+                    'author_id', flat=True
+                )
+            )
+        return self.context['subscribed_author_ids']
 
 
 class UserAvatarSerializer(serializers.ModelSerializer):
@@ -62,10 +89,7 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с ингредиентами в рецепте"""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient'
-    )
+    id = serializers.IntegerField(source='ingredient_id')
     amount = serializers.IntegerField(min_value=MIN_AMOUNT)
 
     class Meta:
@@ -96,8 +120,22 @@ class RecipeGetShortSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class RecipeGetListSerializer(serializers.ListSerializer):
+    """Сериализатор списка рецептов с кэшированием представлений"""
+
+    def to_representation(self, recipes):
+        return self.child.represent_recipes(list(
+            recipes.all() if isinstance(recipes, Manager) else recipes
+        ))
+
+
 class RecipeGetSerializer(serializers.ModelSerializer):
-    """Сериализатор для отображения полной информации о рецепте"""
+    """Сериализатор для отображения полной информации о рецепте.
+
+    Общая для всех пользователей часть представления кэшируется
+    с учетом версий рецепта, автора, тэгов и ингредиентов,
+    флаги пользователя добавляются к ней при каждом запросе.
+    """
     ingredients = IngredientGetSerializer(
         many=True,
         read_only=True,
@@ -107,6 +145,7 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     is_favorited = GetIsFavoritedShippingCartField(model=Favorite)
     is_in_shopping_cart = GetIsFavoritedShippingCartField(model=ShoppingCart)
+    image_variants = ImageVariantsField(source='image')
 
     class Meta:
         model = Recipe
@@ -119,9 +158,79 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         )
+        list_serializer_class = RecipeGetListSerializer
+
+    user_fields = ('is_favorited', 'is_in_shopping_cart')
+
+    def to_representation(self, recipe):
+        return self.represent_recipes([recipe])[0]
+
+    def represent_recipes(self, recipes):
+        cache_keys = self.get_cache_keys(recipes)
+        shared = cache.get_many(cache_keys.values())
+        missing = [recipe for recipe in recipes
+                   if cache_keys[recipe.id] not in shared]
+        if missing:
+            prefetch_related_objects(
+                missing, 'tags', 'recipeingredients__ingredient'
+            )
+            represented = {cache_keys[recipe.id]: self.represent_shared(recipe)
+                           for recipe in missing}
+            cache.set_many(represented)
+            shared.update(represented)
+        return [self.add_user_fields(recipe, shared[cache_keys[recipe.id]])
+                for recipe in recipes]
+
+    def get_cache_keys(self, recipes):
+        versions = get_versions({
+            'tags', 'ingredients',
+            *(recipe_version_name(recipe.id) for recipe in recipes),
+            *(user_version_name(recipe.author_id) for recipe in recipes)
+        })
+        host = self.context['request'].build_absolute_uri('/')
+        return {
+            recipe.id: 'recipe:{id}:{digest}'.format(
+                id=recipe.id,
+                digest=md5('|'.join(map(str, (
+                    host,
+                    versions[recipe_version_name(recipe.id)],
+                    versions[user_version_name(recipe.author_id)],
+                    versions['tags'],
+                    versions['ingredients']
+                ))).encode()).hexdigest()
+            )
+            for recipe in recipes
+        }
+
+    def represent_shared(self, recipe):
+        data = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in self.user_fields:
+                continue
+            attribute = field.get_attribute(recipe)
+            data[field.field_name] = (None if attribute is None
+                                      else field.to_representation(attribute))
+        data['author'].pop('is_subscribed')
+        return data
+
+    def add_user_fields(self, recipe, shared):
+        data = {
+            **shared,
+            'author': OrderedDict(
+                shared['author'],
+                is_subscribed=self.fields['author'].get_is_subscribed(
+                    recipe.author
+                )
+            ),
+            **{name: self.fields[name].to_representation(recipe)
+               for name in self.user_fields}
+        }
+        return OrderedDict((field.field_name, data[field.field_name])
+                           for field in self._readable_fields)
 
 
 class RecipeAddUpdateSerializer(serializers.ModelSerializer):
@@ -151,23 +260,46 @@ class RecipeAddUpdateSerializer(serializers.ModelSerializer):
         )
 
     def validate_ingredients(self, ingredients):
-        return self.validate_elements(ingredients)
+        ingredients = self.validate_elements(
+            ingredients, key=itemgetter('ingredient_id')
+        )
+        ingredient_ids = {
+            ingredient['ingredient_id'] for ingredient in ingredients
+        }
+        missing_ids = ingredient_ids - set(
+            Ingredient.objects.filter(
+                pk__in=ingredient_ids
+            ).values_list('pk', flat=True)
+        )
+        if missing_ids:
+            does_not_exist = PrimaryKeyRelatedField.default_error_messages[
+                'does_not_exist'
+            ]
+            raise serializers.ValidationError([
+                {'id': [does_not_exist.format(
+                    pk_value=ingredient['ingredient_id']
+                )]}
+                if ingredient['ingredient_id'] in missing_ids else {}
+                for ingredient in ingredients
+            ])
+        return ingredients
 
     def validate_tags(self, tags):
         return self.validate_elements(tags)
 
-    def validate_elements(self, elements):
+    def validate_elements(self, elements, key=None):
         if not elements:
             raise serializers.ValidationError(
                 f'Отсутствуют {elements.__class__.__name__}'
             )
-        elements_list = []
+        seen = set()
         for element in elements:
-            if element in elements_list:
+            element_key = element if key is None else key(element)
+            if element_key in seen:
                 raise serializers.ValidationError(
                     f'{element.__class__.__name__} повторяются'
                 )
-            elements_list.append(element)
+            seen.add(element_key)
         return elements
 
     @staticmethod
@@ -175,27 +307,81 @@ class RecipeAddUpdateSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         RecipeIngredient.objects.bulk_create(
             RecipeIngredient(
-                ingredient=recipe_ingredient['ingredient'],
+                ingredient_id=recipe_ingredient['ingredient_id'],
                 recipe=recipe,
                 amount=recipe_ingredient['amount'])
             for recipe_ingredient in ingredients)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Запись только изменившихся продуктов рецепта.
+
+        Возвращает изменения количеств {id продукта: изменение}.
+        """
+        amounts = {
+            ingredient['ingredient_id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient
+            in recipe.recipeingredients.select_for_update()
+        }
+        deltas = {
+            ingredient_id: amounts.get(ingredient_id, 0) - (
+                current[ingredient_id].amount if ingredient_id in current
+                else 0
+            )
+            for ingredient_id in amounts.keys() | current.keys()
+        }
+        changed = []
+        removed = []
+        for ingredient_id, recipe_ingredient in current.items():
+            if ingredient_id not in amounts:
+                removed.append(recipe_ingredient.pk)
+            elif deltas[ingredient_id]:
+                recipe_ingredient.amount = amounts[ingredient_id]
+                changed.append(recipe_ingredient)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        )
+        return deltas
+
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
         self.add_ingredients_tags(recipe, ingredients, tags)
+        bump_version(recipe_version_name(recipe.id))
+        send_recipe_ingredients_changed([recipe.id])
         return recipe
 
     def update(self, recipe, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe.tags.clear()
-        recipe.tags.set(tags)
-        recipe.recipeingredients.all().delete()
-        self.add_ingredients_tags(recipe, ingredients, tags)
-        return super().update(recipe, validated_data)
+        with transaction.atomic():
+            recipe.tags.set(tags)
+            deltas = self.update_ingredients(recipe, ingredients)
+            if any(deltas.values()):
+                send_recipe_ingredients_changed([recipe.id])
+                ShoppingCartIngredient.objects.change_recipe_amounts(
+                    recipe.id, deltas
+                )
+            old_image = recipe.image
+            recipe = super().update(recipe, validated_data)
+            if old_image.name != recipe.image.name:
+                enqueue_image_deletion(old_image)
+        bump_version(recipe_version_name(recipe.id))
+        return recipe
 
     def validate(self, attrs):
         if not attrs.get('image'):
@@ -211,16 +397,13 @@ class RecipeAddUpdateSerializer(serializers.ModelSerializer):
         return attrs
 
     def to_representation(self, instance):
-        return RecipeGetSerializer(
-            instance,
-            context={'request': self.context.get('request')}
-        ).data
+        return RecipeGetSerializer(instance, context=self.context).data
 
 
 class AuthorFollowRepresentSerializer(UserRepresentSerializer):
     """Сериализатор для отображения информации о подписках пользователя"""
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='recipes.count')
+    recipes = RecipeGetShortSerializer(many=True, read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserRepresentSerializer.Meta):
         model = User
@@ -230,8 +413,39 @@ class AuthorFollowRepresentSerializer(UserRepresentSerializer):
             'recipes_count'
         )
 
-    def get_recipes(self, author):
-        return RecipeGetShortSerializer(
-            Recipe.objects.filter(author=author)[:int(
-                self.context['request'].GET.get('recipes_limit', 10 ** 10)
-            )], many=True).data
+
+class JobSerializer(serializers.ModelSerializer):
+    """Сериализатор для отображения состояния фоновой задачи"""
+
+    class Meta:
+        model = Job
+        fields = (
+            'id',
+            'name',
+            'status',
+            'attempts',
+            'error',
+            'created_at',
+            'finished_at'
+        )
+        read_only_fields = fields
+
+
+class AvailableRecipesParamsSerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся продуктам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+    max_missing = serializers.IntegerField(min_value=0, default=0)
+
+    def to_internal_value(self, query_params):
+        return super().to_internal_value({
+            'ingredients': [
+                ingredient_id
+                for value in query_params.getlist('ingredients')
+                for ingredient_id in value.split(',') if ingredient_id
+            ],
+            **({'max_missing': query_params['max_missing']}
+               if 'max_missing' in query_params else {})
+        })
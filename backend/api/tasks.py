@@ -0,0 +1,70 @@
+import codecs
+import json
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from api.renderers import PdfRenderer
+from api.utils import (
+    get_shopping_cart, get_shopping_cart_cache_key,
+    render_shopping_cart, render_shopping_cart_pdf
+)
+from recipes.importers import RecipeImporter
+from recipes.jobs import task
+
+IMPORT_STATE_SUFFIX = '.state'
+
+
+@task('render_shopping_cart_pdf')
+def render_shopping_cart_pdf_task(user_id, key=None, **kwargs):
+    """Рендер списка покупок в PDF, файл сохраняется в задаче.
+
+    Если корзина изменилась после постановки задачи и ключ файла
+    key устарел, файл не сохраняется: следующий запрос поставит
+    задачу для нового состояния корзины.
+    """
+    recipes, ingredients = get_shopping_cart(user_id)
+    content = render_shopping_cart_pdf(
+        list(render_shopping_cart(recipes, ingredients)),
+        settings.SHOPPING_CART_PDF_FONT
+    )
+    if key is not None and key != get_shopping_cart_cache_key(
+        user_id, PdfRenderer.format
+    ):
+        return None
+    return content
+
+
+@task('import_recipes')
+def import_recipes_task(path):
+    """Импорт рецептов из загруженного файла JSON Lines.
+
+    После каждой пачки номер строки сохраняется рядом с файлом,
+    чтобы повтор задачи продолжил импорт без дублей. Итоги импорта
+    сохраняются в задаче в формате JSON.
+    """
+    state_path = path + IMPORT_STATE_SUFFIX
+    skip = 0
+    if default_storage.exists(state_path):
+        with default_storage.open(state_path) as state:
+            skip = json.load(state)['line']
+    importer = RecipeImporter()
+    with default_storage.open(path, 'rb') as file:
+        for line_number in importer.import_batches(
+            codecs.iterdecode(file, 'utf-8'), skip
+        ):
+            default_storage.delete(state_path)
+            default_storage.save(state_path, ContentFile(
+                json.dumps({'line': max(skip, line_number)})
+            ))
+    default_storage.delete(state_path)
+    default_storage.delete(path)
+    return json.dumps({
+        'created': importer.created,
+        'rate': round(importer.rate, 1),
+        'errors': [
+            {'line': line_number, 'error': error}
+            for line_number, error in importer.errors
+        ]
+    }, ensure_ascii=False).encode()
@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from api.views import (IngredientViewSet,
+from api.views import (IngredientViewSet, JobViewSet,
                        RecipeViewSet, TagViewSet,
                        UsersViewSet)
 
@@ -10,6 +10,7 @@ router = routers.DefaultRouter()
 app_name = 'api'
 
 router.register('ingredients', IngredientViewSet, 'ingredient')
+router.register('jobs', JobViewSet, 'job')
 router.register('recipes', RecipeViewSet, 'recipe')
 router.register('tags', TagViewSet, 'tag')
 router.register('users', UsersViewSet, 'user')
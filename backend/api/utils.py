@@ -1,8 +1,32 @@
-from datetime import date
+import csv
+import io
+import os
+from datetime import date, datetime, timezone
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import F
+from django.views.decorators.http import condition
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from recipes.models import Recipe, ShoppingCart, ShoppingCartIngredient
+from recipes.versions import (
+    cart_version_name, get_version, get_versions,
+    recipe_version_name, user_version_name
+)
 
 INGREDIENTS_TEMPLATE = '{index}) {name} - {quantity} ({measure_unit})'
 RECIPES_TEMPLATE = '{index}) {name}.  @{author}'
 
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FALLBACK_FONT_NAME = 'Helvetica'
+PDF_FONT_SIZE = 12
+PDF_LEADING = 18
+PDF_MARGIN = 50
+
 MONTHS = {
     1: 'января',
     2: 'февраля',
@@ -19,34 +43,144 @@ MONTHS = {
 }
 
 
+def get_shopping_cart(user_id):
+    """Рецепты и суммы продуктов корзины пользователя"""
+    recipes = Recipe.objects.filter(
+        shoppingcarts__user_id=user_id
+    ).order_by('name').values('name', 'author__username')
+    ingredients = ShoppingCartIngredient.objects.filter(
+        user_id=user_id
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        quantity=F('amount')
+    ).order_by('ingredient__name')
+    return recipes, ingredients
+
+
 def render_shopping_cart(recipes, ingredients):
-    """Рендер списка продуктов для рецептов"""
-    today = (f'{date.today().day} {MONTHS[date.today().month]} '
-             f'{date.today().year}')
-    ingredients_to_render = [
-        INGREDIENTS_TEMPLATE.format(
+    """Рендер списка продуктов для рецептов построчно"""
+    today = date.today()
+    yield 'Список покупок на: {today}'.format(
+        today=f'{today.day} {MONTHS[today.month]} {today.year}'
+    )
+    yield '\nПродукты'
+    for index, ingredient in enumerate(ingredients, start=1):
+        yield '\n' + INGREDIENTS_TEMPLATE.format(
             index=index,
             name=ingredient['ingredient__name'].capitalize(),
             quantity=ingredient['quantity'],
             measure_unit=ingredient['ingredient__measurement_unit']
         )
-        for index, ingredient in enumerate(ingredients, start=1)
-    ]
-    recipes_to_render = [
-        RECIPES_TEMPLATE.format(
+    yield '\nРецепты'
+    for index, recipe in enumerate(recipes, start=1):
+        yield '\n' + RECIPES_TEMPLATE.format(
             index=index,
-            name=recipe.name,
-            author=recipe.author.username
+            name=recipe['name'],
+            author=recipe['author__username']
         )
-        for index, recipe in enumerate(recipes, start=1)
+
+
+class EchoBuffer:
+    """Буфер, возвращающий записанную в него строку"""
+
+    def write(self, value):
+        return value
+
+
+def render_shopping_cart_csv(recipes, ingredients):
+    """Рендер списка продуктов в формате CSV построчно"""
+    writer = csv.writer(EchoBuffer())
+    yield writer.writerow(('Продукт', 'Количество', 'Единица измерения'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'].capitalize(),
+            ingredient['quantity'],
+            ingredient['ingredient__measurement_unit']
+        ))
+    yield writer.writerow(())
+    yield writer.writerow(('Рецепт', 'Автор'))
+    for recipe in recipes:
+        yield writer.writerow((recipe['name'], recipe['author__username']))
+
+
+def render_shopping_cart_pdf(lines, font_path):
+    """Рендер строк списка продуктов в PDF"""
+    font_name = PDF_FALLBACK_FONT_NAME
+    if os.path.exists(font_path):
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, font_path))
+        font_name = PDF_FONT_NAME
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    pdf.setFont(font_name, PDF_FONT_SIZE)
+    position = height - PDF_MARGIN
+    for line in lines:
+        if position < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font_name, PDF_FONT_SIZE)
+            position = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, position, line.strip('\n'))
+        position -= PDF_LEADING
+    pdf.save()
+    return buffer.getvalue()
+
+
+def get_shopping_cart_cache_key(user_id, file_format):
+    """Ключ файла списка покупок.
+
+    Учитывает версии корзины, входящих в нее рецептов, их авторов
+    и справочника продуктов, названия и единицы измерения которых
+    попадают в файл.
+    """
+    cart = list(ShoppingCart.objects.filter(
+        user_id=user_id
+    ).order_by().values_list('recipe_id', 'recipe__author_id'))
+    version_names = [
+        cart_version_name(user_id),
+        'ingredients',
+        *(recipe_version_name(recipe_id) for recipe_id, _ in cart),
+        *(user_version_name(author_id) for _, author_id in cart)
     ]
-    shopping_list = '\n'.join(
-        [
-            'Список покупок на: {today}'.format(today=today),
-            'Продукты',
-            *ingredients_to_render,
-            'Рецепты',
-            *recipes_to_render
-        ]
+    versions = get_versions(version_names)
+    return 'shopping_cart:{user}:{today}:{file_format}:{digest}'.format(
+        user=user_id,
+        today=date.today().isoformat(),
+        file_format=file_format,
+        digest=md5('|'.join(
+            str(versions[name]) for name in version_names
+        ).encode()).hexdigest()
     )
-    return shopping_list
+
+
+def cache_rendered(cache_key, chunks):
+    """Отдача частей файла с сохранением файла в кэш после рендера"""
+    rendered = []
+    for chunk in chunks:
+        rendered.append(chunk)
+        yield chunk
+    cache.set(cache_key, ''.join(rendered))
+
+
+def get_request_version(request, version_name):
+    """Версия данных, прочитанная из кэша один раз за запрос"""
+    request = getattr(request, '_request', request)
+    if not hasattr(request, 'versions'):
+        request.versions = {}
+    if version_name not in request.versions:
+        request.versions[version_name] = get_version(version_name)
+    return request.versions[version_name]
+
+
+def versioned_condition(version_name):
+    """Условные GET-запросы (ETag, Last-Modified) по версии данных"""
+    def get_etag(request, *args, **kwargs):
+        return f'"{version_name}-{get_request_version(request, version_name)}"'
+
+    def get_last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(
+            get_request_version(request, version_name), tz=timezone.utc
+        )
+
+    return condition(etag_func=get_etag, last_modified_func=get_last_modified)
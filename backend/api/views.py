@@ -1,35 +1,61 @@
+import json
+import uuid
 from datetime import date
+from urllib.parse import urlencode
 
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import FileResponse
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, OuterRef,
+                              Prefetch, Subquery, Value)
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.decorators import method_decorator
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import (permissions,
                             status, viewsets)
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 
 from api.filtersets import IngredientFilter, RecipeFilterSet
-from api.pagination import FoodgramPaginator
+from api.indexes import ingredient_index, recipe_ingredient_index
 from api.permissions import IsOwnerOrReadOnly
 from api.serializers import (
-    AuthorFollowRepresentSerializer,
-    IngredientSerializer, RecipeAddUpdateSerializer,
+    AuthorFollowRepresentSerializer, AvailableRecipesParamsSerializer,
+    IngredientSerializer, JobSerializer, RecipeAddUpdateSerializer,
     RecipeGetSerializer, RecipeGetShortSerializer,
     TagSerializer, UserAvatarSerializer)
-from api.utils import render_shopping_cart
+from api.renderers import CsvRenderer, PdfRenderer, TxtRenderer
+from api.utils import (
+    cache_rendered, get_request_version, get_shopping_cart,
+    get_shopping_cart_cache_key,
+    render_shopping_cart, render_shopping_cart_csv,
+    versioned_condition
+)
+from recipes.jobs import enqueue
 from recipes.models import (
-    Ingredient, Favorite, Follow, Recipe, RecipeIngredient,
+    Ingredient, Favorite, Follow, Job, Recipe,
     ShoppingCart, Tag
 )
+from recipes.tasks import enqueue_image_deletion
 
 
 User = get_user_model()
 
+IMPORT_RECIPES_TASK = 'import_recipes'
+IMPORTS_DIR = 'imports'
+SHOPPING_CART_PDF_TASK = 'render_shopping_cart_pdf'
+SHOPPING_CART_RENDERERS = {
+    TxtRenderer.format: render_shopping_cart,
+    CsvRenderer.format: render_shopping_cart_csv,
+    PdfRenderer.format: render_shopping_cart
+}
+
 
 class UsersViewSet(UserViewSet):
     """Вьюсет для работы с пользователями"""
@@ -46,24 +72,24 @@ class UsersViewSet(UserViewSet):
             permission_classes=(permissions.IsAuthenticated,),
             detail=False)
     def set_avatar(self, request):
-        """Смена аватарки"""
-        if request.method == 'PUT':
-            if 'avatar' not in request.data:
-                raise ValidationError('Требуется загрузка аватара')
-            serializer = UserAvatarSerializer(
-                request.user,
-                data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data,
-                            status=status.HTTP_200_OK)
-        request.user.avatar.delete()
+        """Смена аватарки.
+
+        Прежний файл аватара удаляется фоновой задачей.
+        """
+        if request.method == 'PUT' and 'avatar' not in request.data:
+            raise ValidationError('Требуется загрузка аватара')
+        old_avatar = request.user.avatar
         serializer = UserAvatarSerializer(
             request.user,
-            data={'avatar': None}
+            data=request.data if request.method == 'PUT' else {'avatar': None}
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        if old_avatar.name != request.user.avatar.name:
+            enqueue_image_deletion(old_avatar)
+        if request.method == 'PUT':
+            return Response(serializer.data,
+                            status=status.HTTP_200_OK)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=('get',),
@@ -72,19 +98,37 @@ class UsersViewSet(UserViewSet):
             detail=False)
     def get_subscriptions(self, request, **kwargs):
         """Подписки пользователя"""
-        paginator = FoodgramPaginator()
-        subscription_authors = [
-            subscription.author for subscription in
-            Follow.objects.filter(user=request.user)
-        ]
-        paginated_subscriptions = paginator.paginate_queryset(
-            subscription_authors, request
-        )
+        authors = self.get_authors_with_recipes(request).filter(
+            subscribers__user=request.user
+        ).order_by('username')
         serializer = AuthorFollowRepresentSerializer(
-            paginated_subscriptions,
+            self.paginate_queryset(authors),
             many=True,
-            context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+            context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @staticmethod
+    def get_authors_with_recipes(request):
+        """Авторы с количеством рецептов и рецептами для отображения.
+
+        Последние recipes_limit рецептов всех авторов страницы
+        загружаются одним запросом.
+        """
+        recipes = Recipe.objects.all()
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit is not None:
+            if not recipes_limit.isdigit():
+                raise ValidationError(
+                    'Параметр recipes_limit должен быть целым числом'
+                )
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:int(recipes_limit)]
+            ))
+        return User.objects.prefetch_related(
+            Prefetch('recipes', queryset=recipes)
+        )
 
     @action(methods=('post', 'delete',),
             url_path='subscribe',
@@ -110,8 +154,8 @@ class UsersViewSet(UserViewSet):
             )
         return Response(
             AuthorFollowRepresentSerializer(
-                author,
-                context={'request': request}
+                self.get_authors_with_recipes(request).get(pk=author.pk),
+                context=self.get_serializer_context()
             ).data,
             status=status.HTTP_201_CREATED)
 
@@ -119,16 +163,116 @@ class UsersViewSet(UserViewSet):
 class RecipeViewSet(viewsets.ModelViewSet):
     """Вьюсет для работы с рецептами"""
     queryset = Recipe.objects.all()
-    search_fields = ('author.id', 'tags', 'user.favorites')
     permission_classes = (IsOwnerOrReadOnly,)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilterSet
 
+    def get_queryset(self):
+        recipes = Recipe.objects.select_related('author')
+        user = self.request.user
+        if not user.is_authenticated:
+            return recipes.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField())
+            )
+        return recipes.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
+
     def get_serializer_class(self):
         if self.request.method not in permissions.SAFE_METHODS:
             return RecipeAddUpdateSerializer
         return RecipeGetSerializer
 
+    def perform_destroy(self, recipe):
+        image = recipe.image
+        super().perform_destroy(recipe)
+        enqueue_image_deletion(image)
+
+    @action(methods=('post',),
+            url_path='import',
+            permission_classes=(permissions.IsAdminUser,),
+            parser_classes=(MultiPartParser,),
+            detail=False)
+    def import_recipes(self, request):
+        """Импорт рецептов из загруженного файла JSON Lines.
+
+        Файл сохраняется в хранилище и импортируется фоновой задачей,
+        возвращается 202 со ссылкой на нее и на итоги импорта.
+        """
+        jsonl_file = request.FILES.get('file')
+        if jsonl_file is None:
+            raise ValidationError('Не передан файл с рецептами')
+        path = default_storage.save(
+            f'{IMPORTS_DIR}/{uuid.uuid4().hex}.jsonl', jsonl_file
+        )
+        job = enqueue(IMPORT_RECIPES_TASK, {'path': path}, user=request.user)
+        return self.get_import_job_response(job)
+
+    @action(methods=('get',),
+            url_path=r'import/(?P<job_id>\d+)',
+            permission_classes=(permissions.IsAdminUser,),
+            detail=False)
+    def import_result(self, request, job_id):
+        """Итоги импорта рецептов или 202, пока задача выполняется"""
+        job = get_object_or_404(Job, pk=job_id, name=IMPORT_RECIPES_TASK)
+        if job.status == Job.DONE and job.result is not None:
+            return Response(json.loads(bytes(job.result)))
+        if job.status == Job.FAILED:
+            raise ValidationError(f'Импорт завершился ошибкой: {job.error}')
+        return self.get_import_job_response(job)
+
+    @staticmethod
+    def get_import_job_response(job):
+        return Response(
+            {'detail': 'Рецепты импортируются, повторите запрос позже',
+             'job': JobSerializer(job).data,
+             'result': reverse('api:recipe-import-result',
+                               args=(job.id,))},
+            status=status.HTTP_202_ACCEPTED,
+            headers={
+                'Retry-After': '1',
+                'Location': reverse('api:job-detail', args=(job.id,))
+            }
+        )
+
+    @action(methods=('get',),
+            url_path='available',
+            detail=False)
+    def available(self, request):
+        """Рецепты из имеющихся продуктов.
+
+        Продукты передаются параметром ingredients, max_missing
+        ограничивает число недостающих продуктов рецепта.
+        """
+        params = AvailableRecipesParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        recipe_ids, covered, missing = recipe_ingredient_index.search(
+            params.validated_data['ingredients'],
+            params.validated_data['max_missing']
+        )
+        counts = dict(zip(
+            recipe_ids.tolist(), zip(covered.tolist(), missing.tolist())
+        ))
+        page = self.paginate_queryset(recipe_ids.tolist())
+        recipes = self.get_queryset().in_bulk(page)
+        data = RecipeGetSerializer(
+            [recipes[recipe_id] for recipe_id in page
+             if recipe_id in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        ).data
+        for recipe in data:
+            recipe['covered_ingredients'], recipe['missing_ingredients'] = (
+                counts[recipe['id']]
+            )
+        return self.get_paginated_response(data)
+
     @action(methods=('get',),
             url_path='get-link',
             detail=True)
@@ -183,36 +327,107 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(methods=('get',),
             url_path='download_shopping_cart',
             permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(TxtRenderer, CsvRenderer, PdfRenderer),
             detail=False)
     def download_shopping_cart(self, request, *args, **kwargs):
-        """Скачивание ингредиентов для рецептов, добавленных в корзину"""
-        recipes = [shoppingcart.recipe
-                   for shoppingcart in request.user.shoppingcarts.all()]
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shoppingcarts__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            quantity=Sum('amount')
-        ).order_by('ingredient__name')
-        shopping_list = render_shopping_cart(
-            recipes,
-            ingredients
-        )
-        filename = f'shopping_list_{date.today().strftime("%d-%m-%Y")}.txt'
-        return FileResponse(shopping_list,
-                            filename=filename,
-                            content_type='text/plain')
+        """Скачивание ингредиентов для рецептов, добавленных в корзину.
+
+        Формат файла (txt, csv, pdf) задается параметром format,
+        готовые файлы хранятся до изменения корзины: txt и csv
+        в кэше, pdf - в результате фоновой задачи.
+        """
+        file_format = request.query_params.get('format', TxtRenderer.format)
+        if file_format not in SHOPPING_CART_RENDERERS:
+            raise ValidationError(f'Неизвестный формат файла {file_format}')
+        content_type = request.accepted_renderer.media_type
+        filename = 'shopping_list_{today}.{file_format}'.format(
+            today=date.today().strftime("%d-%m-%Y"),
+            file_format=file_format
+        )
+        cache_key = get_shopping_cart_cache_key(request.user.id, file_format)
+        if file_format == PdfRenderer.format:
+            return self.get_shopping_cart_pdf_response(
+                request, cache_key, content_type, filename
+            )
+        content = cache.get(cache_key)
+        if content is not None:
+            return self.get_shopping_cart_response(
+                HttpResponse(content, content_type=content_type), filename
+            )
+        recipes, ingredients = get_shopping_cart(request.user.id)
+        shopping_list = SHOPPING_CART_RENDERERS[file_format](
+            recipes.iterator(),
+            ingredients.iterator()
+        )
+        return self.get_shopping_cart_response(
+            StreamingHttpResponse(
+                cache_rendered(cache_key, shopping_list),
+                content_type=content_type
+            ),
+            filename
+        )
+
+    def get_shopping_cart_pdf_response(self, request, cache_key,
+                                       content_type, filename):
+        """PDF списка покупок из результата фоновой задачи.
+
+        Задача ставится в очередь, если для текущего состояния корзины
+        ее еще нет или прежняя завершилась без файла или с ошибкой.
+        Пока задача выполняется, возвращается 202 со ссылкой на нее.
+        """
+        job = Job.objects.filter(
+            name=SHOPPING_CART_PDF_TASK, user=request.user, key=cache_key
+        ).order_by('-created_at').first()
+        if job is None or job.status == Job.FAILED or (
+            job.status == Job.DONE and job.result is None
+        ):
+            # Файлы прежних состояний корзины больше не нужны.
+            Job.objects.filter(
+                name=SHOPPING_CART_PDF_TASK, user=request.user,
+                result__isnull=False
+            ).update(result=None)
+            job = enqueue(
+                SHOPPING_CART_PDF_TASK,
+                {'user_id': request.user.id, 'key': cache_key},
+                user=request.user,
+                key=cache_key
+            )
+        if job.status == Job.DONE:
+            return self.get_shopping_cart_response(
+                HttpResponse(bytes(job.result), content_type=content_type),
+                filename
+            )
+        return Response(
+            {'detail': 'Файл готовится, повторите запрос позже',
+             'job': JobSerializer(job).data},
+            status=status.HTTP_202_ACCEPTED,
+            content_type='application/json',
+            headers={
+                'Retry-After': '1',
+                'Location': reverse('api:job-detail', args=(job.id,))
+            }
+        )
+
+    @staticmethod
+    def get_shopping_cart_response(response, filename):
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(
+            request,
+            force=force or self.action == 'download_shopping_cart'
+        )
 
     def add_favorite_shopping_cart(self, request, model, pk):
         """Функция для добавления рецепта в избранное или в корзину"""
         user = request.user
         recipe = get_object_or_404(Recipe, id=pk)
-        instance, created = model.objects.get_or_create(
-            user=user,
-            recipe=recipe
-        )
+        with transaction.atomic():
+            instance, created = model.objects.get_or_create(
+                user=user,
+                recipe=recipe
+            )
         if not created:
             raise ValidationError(f'Рецепт {instance.recipe.name} '
                                   f'уже был добавлен')
@@ -221,24 +436,82 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def delete_favorite_shopping_cart(self, request, model, pk=None):
         """Функция для удаления рецепта из избранного или в корзины"""
-        get_object_or_404(model, recipe_id=pk,
-                          user=request.user).delete()
+        with transaction.atomic():
+            get_object_or_404(model, recipe_id=pk,
+                              user=request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class VersionedReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+    """Базовый вьюсет справочников с кэшированием списка.
+
+    Кэш списка привязан к версии данных version_name, поэтому
+    сбрасывается при любом изменении справочника.
+    """
+    permission_classes = (permissions.AllowAny,)
+    pagination_class = None
+    version_name = None
+
+    def list(self, request, *args, **kwargs):
+        cache_key = 'list:{name}:{version}:{params}'.format(
+            name=self.version_name,
+            version=get_request_version(request, self.version_name),
+            params=self.get_filter_params(request)
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data)
+        return Response(data)
+
+    def get_filter_params(self, request):
+        """Значения параметров фильтров вьюсета в постоянном порядке.
+
+        Прочие параметры не влияют на список и не попадают в ключ кэша.
+        """
+        filterset_class = getattr(self, 'filterset_class', None)
+        if filterset_class is None:
+            return ''
+        return urlencode(sorted(
+            (name, value)
+            for name in filterset_class.base_filters
+            for value in request.query_params.getlist(name)
+        ))
+
+
+@method_decorator(versioned_condition('tags'), name='dispatch')
+class TagViewSet(VersionedReadOnlyViewSet):
     """Вьюсет для отображения информации о тэгах"""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = (permissions.AllowAny,)
-    pagination_class = None
+    version_name = 'tags'
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+@method_decorator(versioned_condition('ingredients'), name='dispatch')
+class IngredientViewSet(VersionedReadOnlyViewSet):
     """Вьюсет для отображения информации об ингредиентах"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    permission_classes = (permissions.AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
-    pagination_class = None
+    version_name = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(
+                name, get_request_version(request, self.version_name)
+            ))
+        return super().list(request, *args, **kwargs)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Вьюсет для отслеживания фоновых задач пользователя"""
+    serializer_class = JobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        jobs = Job.objects.defer('result')
+        if self.request.user.is_staff:
+            return jobs
+        return jobs.filter(user=self.request.user)
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
 ]
 
 REST_FRAMEWORK = {
@@ -125,6 +126,70 @@ if DATABASE_TYPE == 'sqlite3':
 else:
     DATABASES = DATABASE_POSTGRES
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    },
+    # Метки версий данных не вытесняются фрагментами и списками.
+    'versions': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('VERSIONS_CACHE_LOCATION', 'foodgram-versions'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(
+                os.getenv('VERSIONS_CACHE_MAX_ENTRIES', 1000000)
+            ),
+        },
+    },
+}
+
+MAX_IMAGE_UPLOAD_SIZE = int(
+    os.getenv('MAX_IMAGE_UPLOAD_SIZE', 5 * 1024 * 1024)
+)
+
+COOKING_TIME_FILTER_CACHE_TIMEOUT = int(
+    os.getenv('COOKING_TIME_FILTER_CACHE_TIMEOUT', 60)
+)
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+JOBS_TASK_MODULES = ('recipes.tasks', 'api.tasks')
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+JOBS_WORKER_MODE = os.getenv('JOBS_WORKER_MODE', 'thread')
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))
+JOBS_RETRY_DELAY = int(os.getenv('JOBS_RETRY_DELAY', 10))
+JOBS_STALE_TIMEOUT = int(os.getenv('JOBS_STALE_TIMEOUT', 600))
+JOBS_RUN_EAGERLY = os.getenv('JOBS_RUN_EAGERLY', 'False') == 'True'
+
+SERVER_TIMING_PATH_PREFIX = '/api/'
+SERVER_TIMING_N_PLUS_ONE_THRESHOLD = int(
+    os.getenv('SERVER_TIMING_N_PLUS_ONE_THRESHOLD', 10)
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': os.getenv('SERVER_TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -2,13 +2,16 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils.safestring import mark_safe
 
+from recipes.images import get_variant_url
 from recipes.models import (
     Ingredient, Favorite,
-    Follow,
+    Follow, Job,
     RecipeIngredient,
-    Recipe, ShoppingCart, Tag
+    Recipe, ShoppingCart, ShoppingCartIngredient, Tag
 )
 from recipes.admin_filters import (
     CookingTimeFilter,
@@ -29,12 +32,26 @@ class RecipeIngredientInline(admin.TabularInline):
     min_num = 1
 
 
+def count_related(related_objects, field):
+    """Количество связанных объектов коррелированным подзапросом.
+
+    В отличие от Count() по связи, не требует соединения
+    со связанной таблицей и удаления повторов по всей таблице.
+    """
+    return Coalesce(
+        Subquery(
+            related_objects.filter(**{field: OuterRef('pk')}).order_by(
+            ).values(field).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
 class RecipesCountMixin:
-    @admin.display(description='Рецепты')
+    @admin.display(description='Рецепты', ordering='recipes_count')
     def recipes_count(self, obj):
-        if isinstance(obj, Ingredient):
-            return obj.recipeingredients.count()
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 @admin.register(User)
@@ -65,15 +82,17 @@ class FoodgramUserAdmin(RecipesCountMixin, UserAdmin):
     def user_avatar(self, user):
         if not user.avatar:
             return None
-        return f'<img src={user.avatar.url} width ="50" height="50"/>'
+        return '<img src={url} width ="50" height="50"/>'.format(
+            url=get_variant_url(user.avatar, 'admin', 'jpeg')
+        )
 
-    @admin.display(description='Подписки')
+    @admin.display(description='Подписки', ordering='subscriptions_count')
     def following_authors_count(self, user):
-        return user.subscriptions.count()
+        return user.subscriptions_count
 
-    @admin.display(description='Подписчики')
+    @admin.display(description='Подписчики', ordering='subscribers_count')
     def followers_count(self, user):
-        return user.subscribers.count()
+        return user.subscribers_count
 
     @admin.display(description='Рецепты')
     @mark_safe
@@ -84,15 +103,17 @@ class FoodgramUserAdmin(RecipesCountMixin, UserAdmin):
     @mark_safe
     def following_authors_list(self, user):
         return '<br>'.join(
-            follow.author.username for follow in user.subscriptions.all()
-        ) if user.subscriptions.all() else 'Нет подписок'
+            follow.author.username
+            for follow in user.subscriptions.select_related('author')
+        ) or 'Нет подписок'
 
     @admin.display(description='Подписчики')
     @mark_safe
     def followers_list(self, user):
         return '<br>'.join(
-            follow.user.username for follow in user.subscribers.all()
-        ) if user.subscribers.all() else 'Нет подписчиков'
+            follow.user.username
+            for follow in user.subscribers.select_related('user')
+        ) or 'Нет подписчиков'
 
     fieldsets = (
         (
@@ -147,6 +168,13 @@ class IngredientAdmin(RecipesCountMixin, admin.ModelAdmin):
     list_filter = ('measurement_unit', IsInRecipesFilter)
     list_per_page = 25
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=count_related(
+                RecipeIngredient.objects, 'ingredient'
+            )
+        )
+
 
 @admin.register(Tag)
 class TagAdmin(RecipesCountMixin, admin.ModelAdmin):
@@ -154,6 +182,11 @@ class TagAdmin(RecipesCountMixin, admin.ModelAdmin):
     search_fields = ('name', 'slug')
     list_per_page = 25
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            recipes_count=count_related(Recipe.tags.through.objects, 'tag')
+        )
+
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
@@ -171,20 +204,34 @@ class RecipeAdmin(admin.ModelAdmin):
     list_per_page = 25
     inlines = [RecipeIngredientInline]
 
-    @admin.display(description='Время (мин)')
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('tags', 'recipeingredients__ingredient')
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            ShoppingCartIngredient.objects.rebuild_recipe_carts(
+                [form.instance.id]
+            )
+
+    @admin.display(description='Время (мин)', ordering='cooking_time')
     def short_cooking_time(self, recipe):
         return recipe.cooking_time
 
-    @admin.display(description='В избранном')
+    @admin.display(description='В избранном', ordering='favorites_count')
     def is_favorite_count(self, recipe):
-        return recipe.favorites.count()
+        return recipe.favorites_count
 
     @admin.display(description='Изображение')
     @mark_safe
     def recipe_image(self, recipe):
         if not recipe.image:
             return None
-        return f'<img src={recipe.image.url} width ="50" height="50"/>'
+        return '<img src={url} width ="50" height="50"/>'.format(
+            url=get_variant_url(recipe.image, 'admin', 'jpeg')
+        )
 
     @admin.display(description='Продукты')
     @mark_safe
@@ -228,14 +275,61 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     search_fields = ('recipe',)
     list_per_page = 25
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        ShoppingCartIngredient.objects.rebuild_recipe_carts(
+            {obj.recipe_id, form.initial.get('recipe', obj.recipe_id)}
+        )
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingCartIngredient.objects.rebuild_recipe_carts([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingCartIngredient.objects.rebuild_recipe_carts(recipe_ids)
 
-@admin.register(Favorite, ShoppingCart)
+
+@admin.register(Favorite)
 class Favorite(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     list_per_page = 25
 
 
+@admin.register(ShoppingCart)
+class ShoppingCartAdmin(Favorite):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change:
+            ShoppingCartIngredient.objects.rebuild(
+                {obj.user_id, form.initial['user']}
+            )
+
+
 @admin.register(Follow)
 class Follow(admin.ModelAdmin):
     list_display = ('user', 'author')
     list_per_page = 25
+
+
+@admin.register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
+    search_fields = ('user__username', 'ingredient__name')
+    list_per_page = 25
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'user',
+                    'run_at', 'finished_at')
+    list_filter = ('status', 'name')
+    list_select_related = ('user',)
+    search_fields = ('key',)
+    readonly_fields = ('started_at', 'finished_at', 'created_at')
+    list_per_page = 25
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('result')
@@ -1,61 +1,83 @@
-import numpy as np
-
+from django.conf import settings
 from django.contrib import admin
+from django.core.cache import cache
+from django.db.models import Count, Exists, Max, Min, OuterRef, Q
+
+from recipes.models import Follow, Recipe, RecipeIngredient
+from recipes.versions import get_version
+
+COOKING_TIME_BINS = 3
+COOKING_TIME_CACHE_KEY = 'admin:cooking_time_ranges:{version}'
 
 
 class CookingTimeFilter(admin.SimpleListFilter):
     title = 'Время приготовления'
     parameter_name = 'cooking_time'
 
-    def get_histogram(self, cooking_times):
-        hists, bins = np.histogram(cooking_times, bins=3)
-        return {
-            '0': {
-                'range': (round(bins[0]), round(bins[1]) - 1),
-                'quantity': hists[0]
-            },
-            '1': {
-                'range': (round(bins[1]), round(bins[2]) - 1),
-                'quantity': hists[1]
-            },
-            '2': {
-                'range': (round(bins[2]), round(bins[-1])),
-                'quantity': hists[2]
-            }
-        }
-
-    def get_two_unique_cooking_times(self, unique_cooking_times):
+    def get_ranges(self, recipes):
+        """Границы интервалов времени приготовления по min и max"""
+        bounds = recipes.aggregate(
+            low=Min('cooking_time'),
+            high=Max('cooking_time'),
+            unique=Count('cooking_time', distinct=True)
+        )
+        if bounds['unique'] < 2:
+            return []
+        if bounds['unique'] == 2:
+            return [(bounds['low'], bounds['low']),
+                    (bounds['high'], bounds['high'])]
+        edges = [
+            bounds['low'] + round(
+                index * (bounds['high'] - bounds['low']) / COOKING_TIME_BINS
+            )
+            for index in range(COOKING_TIME_BINS + 1)
+        ]
+        ranges = [(low, high - 1) for low, high in zip(edges, edges[1:])]
+        ranges[-1] = (edges[-2], edges[-1])
+        return [(low, high) for low, high in ranges if low <= high]
+
+    def get_histogram(self, recipes):
+        """Интервалы и количество рецептов в них.
+
+        Количество считается одним запросом условной агрегации
+        по тем же интервалам, по которым фильтруется queryset.
+        """
+        ranges = self.get_ranges(recipes)
+        if not ranges:
+            return {}
+        quantities = recipes.aggregate(**{
+            str(index): Count('pk', filter=Q(cooking_time__range=bounds))
+            for index, bounds in enumerate(ranges)
+        })
         return {
-            str(i): {
-                'range': (unique_cooking_times[i], unique_cooking_times[i])
-            }
-            for i in range(len(unique_cooking_times))
+            str(index): {'range': bounds, 'quantity': quantities[str(index)]}
+            for index, bounds in enumerate(ranges)
         }
 
     def lookups(self, request, model_admin):
-        recipes = model_admin.get_queryset(request)
-        cooking_times = [recipe.cooking_time for recipe in recipes.all()]
-        unique_cooking_times = sorted(set(cooking_times))
-        if len(unique_cooking_times) < 2:
+        cache_key = COOKING_TIME_CACHE_KEY.format(
+            version=get_version('recipes')
+        )
+        self.cooking_time_ranges = cache.get(cache_key)
+        if self.cooking_time_ranges is None:
+            self.cooking_time_ranges = self.get_histogram(
+                model_admin.get_queryset(request).order_by()
+            )
+            cache.set(cache_key, self.cooking_time_ranges,
+                      settings.COOKING_TIME_FILTER_CACHE_TIMEOUT)
+        if not self.cooking_time_ranges:
             return None
-        if len(unique_cooking_times) == 2:
-            self.cooking_time_ranges = self.get_two_unique_cooking_times(
-                unique_cooking_times
+        lookups = []
+        for index, ranges in self.cooking_time_ranges.items():
+            low, high = ranges['range']
+            period = f'{low}' if low == high else f'{low} - {high}'
+            lookups.append(
+                (index, f'{period} минут ({ranges["quantity"]})')
             )
-            return [
-                (str(i),
-                 f'{time} минут ({recipes.filter(cooking_time=time).count()})')
-                for i, time in enumerate(unique_cooking_times)
-            ]
-        self.cooking_time_ranges = self.get_histogram(cooking_times)
-        return [
-            (index, f'{ranges["range"][0]} - {ranges["range"][1]} минут '
-                    f'({ranges["quantity"]})')
-            for index, ranges in self.cooking_time_ranges.items()
-        ]
+        return lookups
 
     def queryset(self, request, recipes):
-        if not self.value():
+        if self.value() not in self.cooking_time_ranges:
             return recipes
         cooking_time_range = self.cooking_time_ranges[self.value()]['range']
         return recipes.filter(
@@ -64,12 +86,13 @@ class CookingTimeFilter(admin.SimpleListFilter):
 
 
 class CountFilter(admin.SimpleListFilter):
-    def __init__(self, *args, **kwargs):
-        self.filter_params = self.get_filter_params()
-        super().__init__(*args, **kwargs)
+    """Фильтр по наличию связанных объектов через EXISTS.
 
-    def get_filter_params(self):
-        return {}
+    Связанные объекты - записи related_model, у которых поле
+    related_field ссылается на фильтруемый объект.
+    """
+    related_model = None
+    related_field = None
 
     def lookups(self, request, model_admin):
         return [
@@ -80,66 +103,39 @@ class CountFilter(admin.SimpleListFilter):
         ]
 
     def queryset(self, request, objects):
-        if not self.value():
-            return objects
-        return objects.filter(
-            **self.filter_params[self.value()]
-        ).distinct()
+        exists = Exists(self.related_model.objects.filter(
+            **{self.related_field: OuterRef('pk')}
+        ))
+        if self.value() == '{name}=0'.format(name=self.parameter_name):
+            return objects.filter(~exists)
+        if self.value() == '{name}=1'.format(name=self.parameter_name):
+            return objects.filter(exists)
+        return objects
 
 
 class HasRecipesFilter(CountFilter):
     title = 'Есть рецепты'
     parameter_name = 'hasrecipes'
-
-    def get_filter_params(self):
-        return {
-            'hasrecipes=0': {
-                'recipes__isnull': True
-            },
-            'hasrecipes=1': {
-                'recipes__isnull': False
-            }
-        }
+    related_model = Recipe
+    related_field = 'author'
 
 
 class HasFollowersFilter(CountFilter):
     title = 'Есть подписчики'
     parameter_name = 'hasfollowers'
-
-    def get_filter_params(self):
-        return {
-            'hasfollowers=0':
-                {'followers__isnull': True},
-            'hasfollowers=1':
-                {'followers__isnull': False}
-        }
+    related_model = Follow
+    related_field = 'author'
 
 
 class HasFollowingAuthorsFilter(CountFilter):
     title = 'Есть подписки'
     parameter_name = 'hasfollowingauthors'
-
-    def get_filter_params(self):
-        return {
-            'hasfollowingauthors=0': {
-                'authors__isnull': True
-            },
-            'hasfollowingauthors=1': {
-                'authors__isnull': False
-            }
-        }
+    related_model = Follow
+    related_field = 'user'
 
 
 class IsInRecipesFilter(CountFilter):
     title = 'Есть в рецептах'
     parameter_name = 'isinrecipes'
-
-    def get_filter_params(self):
-        return {
-            'isinrecipes=0': {
-                'recipeingredients__isnull': True
-            },
-            'isinrecipes=1': {
-                'recipeingredients__isnull': False
-            }
-        }
+    related_model = RecipeIngredient
+    related_field = 'ingredient'
@@ -0,0 +1,103 @@
+import random
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import transaction
+
+from recipes.models import (
+    Favorite, Follow, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Tag
+)
+
+BATCH_SIZE = 1000
+SEED = 2024
+TAGS = 10
+RECIPE_IMAGE = 'recipes/images/dataset.png'
+
+SCALES = {
+    'small': {'users': 50, 'ingredients': 300, 'recipes': 500},
+    'medium': {'users': 500, 'ingredients': 1000, 'recipes': 5000},
+    'large': {'users': 2000, 'ingredients': 2000, 'recipes': 50000},
+}
+
+
+def bulk_create(model, objects):
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    return list(model.objects.order_by('pk').values_list('pk', flat=True))
+
+
+@transaction.atomic
+def seed_dataset(scale='small', seed=SEED):
+    """Заполнение пустой БД рецептами, избранным, корзинами и подписками.
+
+    Объем данных задается масштабом из SCALES, содержимое
+    воспроизводится при одинаковом seed. Счетчики и суммы продуктов
+    в корзинах пересчитываются командами после заполнения.
+    """
+    sizes = SCALES[scale]
+    rng = random.Random(seed)
+    password = make_password(None)
+    user_ids = bulk_create(FoodgramUser, (
+        FoodgramUser(
+            username=f'user{number}',
+            email=f'user{number}@example.com',
+            first_name=f'Имя{number}',
+            last_name=f'Фамилия{number}',
+            password=password
+        ) for number in range(sizes['users'])
+    ))
+    tag_ids = bulk_create(Tag, (
+        Tag(name=f'Тэг {number}', slug=f'tag{number}')
+        for number in range(TAGS)
+    ))
+    ingredient_ids = bulk_create(Ingredient, (
+        Ingredient(name=f'Продукт {number}', measurement_unit='г')
+        for number in range(sizes['ingredients'])
+    ))
+    recipe_ids = bulk_create(Recipe, (
+        Recipe(
+            author_id=rng.choice(user_ids),
+            name=f'Рецепт {number}',
+            text=f'Описание рецепта {number}',
+            cooking_time=rng.randint(1, 180),
+            image=RECIPE_IMAGE
+        ) for number in range(sizes['recipes'])
+    ))
+    Recipe.tags.through.objects.bulk_create(
+        (Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+         for recipe_id in recipe_ids
+         for tag_id in rng.sample(tag_ids, rng.randint(1, 3))),
+        batch_size=BATCH_SIZE
+    )
+    RecipeIngredient.objects.bulk_create(
+        (RecipeIngredient(
+            recipe_id=recipe_id,
+            ingredient_id=ingredient_id,
+            amount=rng.randint(1, 500)
+        ) for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(
+                ingredient_ids, rng.randint(3, 10)
+        )),
+        batch_size=BATCH_SIZE
+    )
+    for model, field, related_ids, per_user in (
+        (Favorite, 'recipe_id', recipe_ids, 20),
+        (ShoppingCart, 'recipe_id', recipe_ids, 5),
+        (Follow, 'author_id', user_ids, 10),
+    ):
+        model.objects.bulk_create(
+            (model(user_id=user_id, **{field: related_id})
+             for user_id in user_ids
+             for related_id in rng.sample(related_ids, per_user)
+             if model is not Follow or related_id != user_id),
+            batch_size=BATCH_SIZE
+        )
+    call_command('reconcile_counters', stdout=StringIO())
+    call_command('rebuild_shopping_carts', stdout=StringIO())
+    return {
+        'user_ids': user_ids,
+        'tag_ids': tag_ids,
+        'ingredient_ids': ingredient_ids,
+        'recipe_ids': recipe_ids,
+    }
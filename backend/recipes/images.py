@@ -0,0 +1,113 @@
+import os
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+IMAGE_VARIANTS = {
+    'detail': (1200, 900),
+    'card': (600, 450),
+    'admin': (50, 50),
+}
+CROPPED_VARIANTS = ('admin',)
+IMAGE_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+IMAGE_QUALITY = 80
+VARIANTS_DIR = 'variants'
+JPEG_BACKGROUND = 'white'
+VARIANTS_READY_KEY = 'image_variants:{name}'
+VARIANTS_MISSING_TIMEOUT = 60
+
+
+def get_variant_name(name, size, image_format):
+    """Имя уменьшенной копии рядом с оригиналом в папке variants"""
+    directory, filename = os.path.split(name)
+    return os.path.join(
+        directory, VARIANTS_DIR, f'{filename}.{size}.{image_format}'
+    )
+
+
+def get_variant_names(name):
+    return [get_variant_name(name, size, image_format)
+            for size in IMAGE_VARIANTS for image_format in IMAGE_FORMATS]
+
+
+def has_image_variants(name, storage=default_storage):
+    """Наличие копий проверяется по последней создаваемой из них"""
+    return storage.exists(get_variant_names(name)[-1])
+
+
+def image_variants_ready(name, storage=default_storage):
+    """Наличие копий с кэшированием результата проверки хранилища.
+
+    Отсутствие копий кэшируется ненадолго, после создания копий
+    флаг в кэше выставляет generate_image_variants.
+    """
+    key = VARIANTS_READY_KEY.format(name=name)
+    ready = cache.get(key)
+    if ready is None:
+        ready = has_image_variants(name, storage)
+        cache.set(key, ready, None if ready else VARIANTS_MISSING_TIMEOUT)
+    return ready
+
+
+def get_variant_url(image, size, image_format):
+    """Ссылка на копию изображения или на оригинал, пока копий нет"""
+    if not image_variants_ready(image.name, image.storage):
+        return image.url
+    return image.storage.url(get_variant_name(image.name, size, image_format))
+
+
+def resize(image, size):
+    if size in CROPPED_VARIANTS:
+        return ImageOps.fit(image, IMAGE_VARIANTS[size], Image.LANCZOS)
+    variant = image.copy()
+    variant.thumbnail(IMAGE_VARIANTS[size], Image.LANCZOS)
+    return variant
+
+
+def convert(image, image_format):
+    if image_format != 'jpeg':
+        return image if image.mode in ('RGB', 'RGBA') else image.convert(
+            'RGBA'
+        )
+    if image.mode == 'RGB':
+        return image
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, JPEG_BACKGROUND)
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def generate_image_variants(image):
+    """Создание уменьшенных копий изображения в форматах WebP и JPEG"""
+    with image.open('rb') as file:
+        source = ImageOps.exif_transpose(Image.open(file))
+        source.load()
+    for size in IMAGE_VARIANTS:
+        variant = resize(source, size)
+        for image_format, pillow_format in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            convert(variant, image_format).save(
+                buffer, pillow_format, quality=IMAGE_QUALITY
+            )
+            name = get_variant_name(image.name, size, image_format)
+            image.storage.delete(name)
+            image.storage.save(name, ContentFile(buffer.getvalue()))
+    cache.set(VARIANTS_READY_KEY.format(name=image.name), True, None)
+
+
+def update_image_variants(image):
+    """Создание копий нового изображения, у которого их еще нет"""
+    if image and not has_image_variants(image.name, image.storage):
+        generate_image_variants(image)
+
+
+def delete_image_variants(name, storage=default_storage):
+    for variant_name in get_variant_names(name):
+        storage.delete(variant_name)
+    cache.delete(VARIANTS_READY_KEY.format(name=name))
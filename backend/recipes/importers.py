@@ -0,0 +1,272 @@
+import json
+import os
+import time
+from collections import Counter
+from pathlib import PurePath
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from recipes.models import (
+    COOKING_TIME_MIN, MIN_AMOUNT, NAME_MAX_LENGTH,
+    FoodgramUser, Ingredient, Recipe, RecipeIngredient, Tag
+)
+from recipes.signals import send_recipe_ingredients_changed
+from recipes.tasks import enqueue_image_variants
+from recipes.versions import bump_version
+
+BATCH_SIZE = 500
+
+
+class RecipeImportError(ValueError):
+    """Ошибка в описании импортируемого рецепта"""
+
+
+class RecipeImporter:
+    """Импорт рецептов из строк JSON Lines пачками bulk_create.
+
+    Строка описывает один рецепт: name, text, cooking_time,
+    author (username), tags (слаги или названия), ingredients
+    ([{name, measurement_unit, amount}]) и image - относительный путь
+    к файлу в хранилище MEDIA или, если задан image_dir, к локальному
+    файлу в этом каталоге. Локальные файлы доступны только
+    из команды импорта.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, image_dir=None):
+        self.batch_size = batch_size
+        self.image_dir = image_dir and os.path.realpath(image_dir)
+        self.tags = {}
+        for tag_id, name, slug in Tag.objects.values_list(
+            'id', 'name', 'slug'
+        ):
+            self.tags[name] = self.tags[slug] = tag_id
+        self.ingredients = {}
+        self.ingredient_names = {}
+        for ingredient_id, name, unit in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ):
+            name = name.casefold()
+            self.ingredients[name, unit.casefold()] = ingredient_id
+            self.ingredient_names[name] = (
+                None if name in self.ingredient_names else ingredient_id
+            )
+        self.authors = {}
+        self.images = {}
+        self.created = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        """Количество созданных рецептов в секунду"""
+        return self.created / max(time.monotonic() - self.started, 1e-9)
+
+    def import_batches(self, lines, skip=0):
+        """Импорт строк пачками.
+
+        После записи каждой пачки возвращает номер последней
+        обработанной строки, с которой можно продолжить импорт.
+        """
+        batch = []
+        line_number = written_line_number = skip
+        for line_number, line in enumerate(lines, start=1):
+            if line_number <= skip or not line.strip():
+                continue
+            try:
+                batch.append(self.parse(line))
+            except RecipeImportError as error:
+                self.errors.append((line_number, str(error)))
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                written_line_number = line_number
+                yield line_number
+        if batch:
+            self.write(batch)
+        if line_number > written_line_number:
+            yield line_number
+
+    def import_lines(self, lines):
+        for _ in self.import_batches(lines):
+            pass
+        return self
+
+    def parse(self, line):
+        try:
+            data = json.loads(line)
+            name = data['name']
+            text = data['text']
+            cooking_time = int(data['cooking_time'])
+            author_id = self.get_author_id(data['author'])
+            tag_ids = [self.get_tag_id(tag) for tag in data['tags']]
+            ingredients = [
+                (self.get_ingredient_id(ingredient),
+                 int(ingredient['amount']))
+                for ingredient in data['ingredients']
+            ]
+            image = data['image']
+        except RecipeImportError:
+            raise
+        except json.JSONDecodeError as error:
+            raise RecipeImportError(f'Неверный JSON: {error}')
+        except KeyError as error:
+            raise RecipeImportError(f'Отсутствует поле {error}')
+        except (TypeError, ValueError) as error:
+            raise RecipeImportError(f'Неверное значение: {error}')
+        if not name or len(name) > NAME_MAX_LENGTH:
+            raise RecipeImportError(f'Неверное название рецепта: {name}')
+        if cooking_time < COOKING_TIME_MIN:
+            raise RecipeImportError(
+                f'Неверное время приготовления: {cooking_time}'
+            )
+        if not tag_ids or len(set(tag_ids)) != len(tag_ids):
+            raise RecipeImportError('Тэги отсутствуют или повторяются')
+        ingredient_ids = {ingredient_id for ingredient_id, _ in ingredients}
+        if not ingredients or len(ingredient_ids) != len(ingredients):
+            raise RecipeImportError('Продукты отсутствуют или повторяются')
+        if any(amount < MIN_AMOUNT for _, amount in ingredients):
+            raise RecipeImportError('Неверное количество продукта')
+        recipe = Recipe(
+            author_id=author_id,
+            name=name,
+            text=text,
+            cooking_time=cooking_time,
+            image=self.get_image(image)
+        )
+        return recipe, tag_ids, ingredients
+
+    def get_author_id(self, username):
+        if username not in self.authors:
+            self.authors[username] = FoodgramUser.objects.filter(
+                username=username
+            ).values_list('id', flat=True).first()
+        if self.authors[username] is None:
+            raise RecipeImportError(f'Автор {username} не найден')
+        return self.authors[username]
+
+    def get_tag_id(self, tag):
+        if tag not in self.tags:
+            raise RecipeImportError(f'Тэг {tag} не найден')
+        return self.tags[tag]
+
+    def get_ingredient_id(self, ingredient):
+        name = ingredient['name'].casefold()
+        unit = ingredient.get('measurement_unit')
+        ingredient_id = (
+            self.ingredient_names.get(name) if unit is None
+            else self.ingredients.get((name, unit.casefold()))
+        )
+        if ingredient_id is None:
+            raise RecipeImportError(
+                f'Продукт {ingredient["name"]} не найден или требует '
+                f'единицу измерения'
+            )
+        return ingredient_id
+
+    def get_image(self, path):
+        """Путь к проверенному изображению в хранилище.
+
+        Локальные файлы копируются в хранилище один раз за импорт.
+        """
+        if not isinstance(path, str) or not path or os.path.isabs(path) or (
+            '..' in PurePath(path).parts
+        ):
+            raise RecipeImportError(f'Неверный путь к изображению: {path}')
+        if path not in self.images:
+            try:
+                self.images[path] = (
+                    self.save_local_image(path) if self.image_dir
+                    else self.check_stored_image(path)
+                )
+            except RecipeImportError:
+                raise
+            except (SuspiciousFileOperation, OSError, ValueError) as error:
+                raise RecipeImportError(
+                    f'Ошибка чтения изображения {path}: {error}'
+                )
+        return self.images[path]
+
+    def check_stored_image(self, path):
+        if not default_storage.exists(path):
+            raise RecipeImportError(f'Изображение {path} не найдено')
+        with default_storage.open(path, 'rb') as image:
+            self.verify_image(path, image)
+        return path
+
+    def save_local_image(self, path):
+        full_path = os.path.realpath(os.path.join(self.image_dir, path))
+        if os.path.commonpath((self.image_dir, full_path)) != (
+            self.image_dir
+        ) or not os.path.isfile(full_path):
+            raise RecipeImportError(f'Изображение {path} не найдено')
+        with open(full_path, 'rb') as image:
+            self.verify_image(path, image)
+            image.seek(0)
+            return default_storage.save(
+                os.path.join(
+                    Recipe._meta.get_field('image').upload_to,
+                    os.path.basename(full_path)
+                ),
+                File(image)
+            )
+
+    @staticmethod
+    def verify_image(path, image):
+        """Проверка файла Pillow, как у ImageField сериализаторов"""
+        try:
+            Image.open(image).verify()
+        except Exception:
+            raise RecipeImportError(f'Файл {path} не является изображением')
+
+    def write(self, batch):
+        """Запись пачки рецептов, их тэгов и продуктов в одной транзакции"""
+        recipes = [recipe for recipe, _, _ in batch]
+        with transaction.atomic():
+            self.create_recipes(recipes)
+            Recipe.tags.through.objects.bulk_create(
+                (Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+                 for recipe, tag_ids, _ in batch for tag_id in tag_ids),
+                batch_size=self.batch_size
+            )
+            RecipeIngredient.objects.bulk_create(
+                (RecipeIngredient(
+                    recipe_id=recipe.id,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                ) for recipe, _, ingredients in batch
+                    for ingredient_id, amount in ingredients),
+                batch_size=self.batch_size
+            )
+            send_recipe_ingredients_changed(
+                [recipe.id for recipe in recipes]
+            )
+        for recipe in recipes:
+            enqueue_image_variants(recipe.image)
+        bump_version('recipes')
+        self.created += len(recipes)
+
+    def create_recipes(self, recipes):
+        """Создание рецептов с получением их id.
+
+        Если СУБД не возвращает id из bulk_create, рецепты сохраняются
+        по одному, и счетчики авторов обновляют сигналы.
+        """
+        if not connection.features.can_return_rows_from_bulk_insert:
+            for recipe in recipes:
+                recipe.save()
+            return
+        Recipe.objects.bulk_create(recipes, batch_size=self.batch_size)
+        authors_by_count = {}
+        for author_id, count in Counter(
+            recipe.author_id for recipe in recipes
+        ).items():
+            authors_by_count.setdefault(count, []).append(author_id)
+        for count, author_ids in authors_by_count.items():
+            FoodgramUser.objects.filter(pk__in=author_ids).update(
+                recipes_count=F('recipes_count') + count
+            )
@@ -0,0 +1,150 @@
+import logging
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from recipes.models import Job
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (Job.PENDING, Job.RUNNING)
+CLAIM_CANDIDATES = 10
+
+TASKS = {}
+
+
+def task(name):
+    """Регистрация функции как фоновой задачи с именем name"""
+    def register(function):
+        TASKS[name] = function
+        return function
+    return register
+
+
+def get_task(name):
+    for module in settings.JOBS_TASK_MODULES:
+        import_module(module)
+    return TASKS[name]
+
+
+def enqueue(name, payload=None, user=None, key='', max_attempts=None):
+    """Постановка задачи в очередь.
+
+    Задача с непустым key не дублируется, пока такая же задача
+    ожидает выполнения или выполняется.
+    """
+    if key:
+        job = Job.objects.filter(
+            name=name, key=key, status__in=ACTIVE_STATUSES
+        ).first()
+        if job is not None:
+            return job
+    job = Job.objects.create(
+        name=name,
+        key=key,
+        payload=payload or {},
+        user=user,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS
+    )
+    if settings.JOBS_RUN_EAGERLY:
+        job.status = Job.RUNNING
+        job.attempts = 1
+        job.started_at = timezone.now()
+        run_job(job)
+    return job
+
+
+def claim_job():
+    """Захват следующей задачи из очереди.
+
+    Используется SELECT ... FOR UPDATE SKIP LOCKED, а там, где он
+    не поддерживается (SQLite), - условный UPDATE по статусу задачи.
+    """
+    now = timezone.now()
+    pending = Job.objects.filter(
+        status=Job.PENDING, run_at__lte=now
+    ).order_by('run_at', 'pk')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = pending.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.started_at = now
+            job.save(update_fields=('status', 'attempts', 'started_at'))
+            return job
+    for job in pending[:CLAIM_CANDIDATES]:
+        if Job.objects.filter(pk=job.pk, status=Job.PENDING).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, started_at=now
+        ):
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.started_at = now
+            return job
+    return None
+
+
+def run_job(job):
+    """Выполнение захваченной задачи с повтором при ошибке.
+
+    Байты, которые вернула задача, сохраняются в result.
+    """
+    try:
+        result = get_task(job.name)(**job.payload)
+    except Exception as error:
+        logger.exception('Фоновая задача %s завершилась ошибкой', job)
+        job.error = f'{error.__class__.__name__}: {error}'
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + timedelta(
+                seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.DONE
+        job.error = ''
+        job.finished_at = timezone.now()
+        if isinstance(result, bytes):
+            job.result = result
+    job.save(update_fields=('status', 'run_at', 'finished_at', 'error',
+                            'result'))
+    return job
+
+
+def requeue_stale_jobs():
+    """Возврат в очередь задач, выполнение которых прервалось"""
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=timezone.now() - timedelta(
+            seconds=settings.JOBS_STALE_TIMEOUT
+        )
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        finished_at=timezone.now(),
+        error='Выполнение задачи прервано'
+    )
+    stale.update(status=Job.PENDING)
+
+
+def work(stop, poll_interval, once=False):
+    """Цикл обработчика очереди до установки события stop"""
+    try:
+        while not stop.is_set():
+            job = claim_job()
+            if job is not None:
+                run_job(job)
+                continue
+            if once:
+                return
+            requeue_stale_jobs()
+            stop.wait(poll_interval)
+    finally:
+        connections.close_all()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import (
+    generate_image_variants, has_image_variants
+)
+from recipes.models import FoodgramUser, Recipe
+from recipes.tasks import image_variants_generated
+
+
+class Command(BaseCommand):
+    """Команда для создания уменьшенных копий фото рецептов и аватаров"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate variants that already exist')
+
+    def handle(self, **options):
+        generated = failed = 0
+        for model, field in ((Recipe, 'image'), (FoodgramUser, 'avatar')):
+            names = model.objects.exclude(**{field: ''}).exclude(
+                **{f'{field}__isnull': True}
+            ).order_by().values_list(field, flat=True).distinct()
+            for name in names.iterator():
+                image = model._meta.get_field(field).attr_class(
+                    None, model._meta.get_field(field), name
+                )
+                if not options['force'] and has_image_variants(
+                    name, image.storage
+                ):
+                    continue
+                try:
+                    generate_image_variants(image)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                image_variants_generated(
+                    model._meta.label_lower, field, name
+                )
+                generated += 1
+        self.stdout.write(
+            f'Созданы копии изображений: {generated}, ошибок: {failed}'
+        )
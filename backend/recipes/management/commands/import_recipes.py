@@ -0,0 +1,77 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importers import BATCH_SIZE, RecipeImporter
+
+STATE_FILE_SUFFIX = '.state'
+
+
+class Command(BaseCommand):
+    """Команда для импорта рецептов из файла формата JSON Lines"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('jsonl_file', type=str,
+                            help='The JSON Lines file to import recipes from')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of recipes written per transaction')
+        parser.add_argument('--state-file', type=str,
+                            help='File storing the last imported line '
+                                 '(defaults to <jsonl_file>.state)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the saved state and start over')
+        parser.add_argument('--image-dir', type=str,
+                            help='Directory with local image files; image '
+                                 'paths are relative to it instead of '
+                                 'to the media storage')
+
+    def handle(self, **options):
+        jsonl_file = options['jsonl_file']
+        state_file = options['state_file'] or jsonl_file + STATE_FILE_SUFFIX
+        skip = 0 if options['restart'] else self.read_state(state_file)
+        if skip:
+            self.stdout.write(f'Продолжение импорта со строки {skip + 1}')
+        image_dir = options['image_dir']
+        if image_dir and not os.path.isdir(image_dir):
+            raise CommandError(f'Каталог {image_dir} не найден')
+        importer = RecipeImporter(
+            batch_size=options['batch_size'], image_dir=image_dir
+        )
+        reported_errors = 0
+        try:
+            with open(jsonl_file, encoding='utf-8') as file:
+                for line_number in importer.import_batches(file, skip):
+                    self.write_state(state_file, max(skip, line_number))
+                    for error_line, error in importer.errors[
+                        reported_errors:
+                    ]:
+                        self.stderr.write(f'Строка {error_line}: {error}')
+                    reported_errors = len(importer.errors)
+                    self.stdout.write(
+                        f'Строк обработано: {line_number}, '
+                        f'рецептов создано: {importer.created} '
+                        f'({importer.rate:.1f} рецептов/с)'
+                    )
+        except (OSError, UnicodeDecodeError) as error:
+            raise CommandError(f'Ошибка: {error}. Файл - {jsonl_file}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт завершен: создано {importer.created}, '
+            f'пропущено {len(importer.errors)}'
+        ))
+
+    @staticmethod
+    def read_state(state_file):
+        try:
+            with open(state_file) as file:
+                return json.load(file)['line']
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Неверный файл состояния {state_file}: '
+                               f'{error}')
+
+    @staticmethod
+    def write_state(state_file, line_number):
+        with open(state_file, 'w') as file:
+            json.dump({'line': line_number}, file)
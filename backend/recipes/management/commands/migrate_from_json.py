@@ -1,28 +1,246 @@
+import csv
+import io
 import json
+import re
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from recipes.versions import bump_version
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'\s*')
+NUMBER_TAIL = re.compile(r'[\d.eE+-]*')
+
+
+class JSONArrayReader:
+    """Поэлементное чтение JSON-массива из файла.
+
+    Файл читается частями по chunk_size символов, элементы массива
+    разбираются json.JSONDecoder.raw_decode по мере поступления.
+    """
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def __iter__(self):
+        if self.next_char() != '[':
+            raise ValueError('Файл должен содержать JSON-массив')
+        self.position += 1
+        if self.next_char() == ']':
+            return
+        while True:
+            yield self.decode()
+            char = self.next_char()
+            self.position += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'Ожидается "," или "]", получено "{char}"')
+
+    def read(self):
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return bool(chunk)
+
+    def next_char(self):
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read():
+                raise ValueError('Неожиданный конец файла')
+
+    def decode(self):
+        self.next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except json.JSONDecodeError:
+                if not self.read():
+                    raise
+                continue
+            # Число на границе части могло быть прочитано не целиком
+            # (1e|5), как и значение в самом конце буфера.
+            if NUMBER_TAIL.fullmatch(self.buffer, end) and self.read():
+                continue
+            self.position = end
+            return value
 
 
 class BaseImportCommand(BaseCommand):
-    """Команда для заполнения БД из файла формата JSON"""
+    """Команда для заполнения БД из файла формата JSON.
+
+    Объекты сопоставляются с существующими по lookup_field. В режиме
+    --upsert у найденных объектов обновляются поля update_fields.
+    """
     model = None
+    version_name = None
+    lookup_field = None
+    update_fields = ()
 
     def add_arguments(self, parser):
         parser.add_argument('json_file', type=str,
                             help='The JSON file to import data from')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of objects written per transaction')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Update existing objects instead of '
+                                 'skipping them')
+
+    @property
+    def fields(self):
+        return (self.lookup_field, *self.update_fields)
+
+    @property
+    def lookup_is_unique(self):
+        return self.model._meta.get_field(self.lookup_field).unique
 
-    def handle(self, **kwargs):
-        json_file = kwargs['json_file']
+    def handle(self, **options):
+        json_file = options['json_file']
+        write_batch = (self.copy_batch if connection.vendor == 'postgresql'
+                       else self.write_batch)
+        self.counts = {'created': 0, 'updated': 0, 'skipped': 0}
         try:
-            with open(json_file) as file:
-                created_objects = self.model.objects.bulk_create(
-                    [self.model(**element) for element in json.load(file)],
-                    ignore_conflicts=True
-                )
-                print('Объекты {model} ({number}) успешно загружены'.format(
-                    model=self.model._meta.object_name,
-                    number=len(created_objects)
-                )
+            with open(json_file, encoding='utf-8') as file:
+                elements = iter(JSONArrayReader(file))
+                while True:
+                    rows = [self.get_row(element) for element in islice(
+                        elements, options['batch_size']
+                    )]
+                    if not rows:
+                        break
+                    with transaction.atomic():
+                        write_batch(rows, options['upsert'])
+                    self.stdout.write(self.format_counts('Обработано'))
+        except (OSError, ValueError, TypeError, DatabaseError) as error:
+            raise CommandError(f'Ошибка: {error}. Файл - {json_file}')
+        finally:
+            if self.counts['created'] or self.counts['updated']:
+                bump_version(self.version_name)
+        self.stdout.write(self.style.SUCCESS(
+            self.format_counts(f'Объекты {self.model._meta.object_name} '
+                               f'загружены')
+        ))
+
+    def format_counts(self, title):
+        return ('{title} {total}: создано {created}, обновлено {updated}, '
+                'пропущено {skipped}').format(
+            title=title, total=sum(self.counts.values()), **self.counts
+        )
+
+    def get_row(self, element):
+        if not isinstance(element, dict):
+            raise ValueError(f'Элемент должен быть объектом: {element}')
+        missing = [field for field in self.fields if field not in element]
+        if missing:
+            raise ValueError(f'Отсутствуют поля {missing}: {element}')
+        return tuple(element[field] for field in self.fields)
+
+    def unique_rows(self, rows, upsert):
+        """Строки пачки без повторов ключа сопоставления"""
+        if upsert or self.lookup_is_unique:
+            unique = {row[0]: row for row in rows}
+        else:
+            unique = {row: row for row in rows}
+        self.counts['skipped'] += len(rows) - len(unique)
+        return list(unique.values())
+
+    def write_batch(self, rows, upsert):
+        """Запись пачки через ORM: один SELECT, bulk_create и bulk_update"""
+        rows = self.unique_rows(rows, upsert)
+        existing = {}
+        for obj in self.model.objects.filter(**{
+            f'{self.lookup_field}__in': {row[0] for row in rows}
+        }).order_by('pk'):
+            existing.setdefault(getattr(obj, self.lookup_field), []).append(
+                obj
+            )
+        created, updated = [], []
+        for row in rows:
+            values = dict(zip(self.fields, row))
+            objects = existing.get(row[0], [])
+            if any(all(getattr(obj, field) == values[field]
+                       for field in self.update_fields)
+                   for obj in objects):
+                self.counts['skipped'] += 1
+            elif objects and upsert:
+                for field in self.update_fields:
+                    setattr(objects[0], field, values[field])
+                updated.append(objects[0])
+            elif objects and self.lookup_is_unique:
+                self.counts['skipped'] += 1
+            else:
+                created.append(self.model(**values))
+        self.model.objects.bulk_create(created, ignore_conflicts=True)
+        if updated:
+            self.model.objects.bulk_update(updated, self.update_fields)
+        self.counts['created'] += len(created)
+        self.counts['updated'] += len(updated)
+
+    def copy_batch(self, rows, upsert):
+        """Запись пачки в PostgreSQL через COPY во временную таблицу"""
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        pk = quote(self.model._meta.pk.column)
+        key = quote(self.model._meta.get_field(self.lookup_field).column)
+        columns = [quote(self.model._meta.get_field(field).column)
+                   for field in self.fields]
+        values = [column for column in columns if column != key]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        same_values = ' AND '.join(
+            f'same.{column} = source.{column}' for column in values
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE import_rows ON COMMIT DROP AS '
+                f'SELECT {", ".join(columns)} FROM {table} WITH NO DATA'
+            )
+            cursor.copy_expert(
+                f'COPY import_rows ({", ".join(columns)}) '
+                f'FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+            updated = 0
+            if upsert:
+                cursor.execute(
+                    f'UPDATE {table} AS target SET '
+                    + ', '.join(f'{column} = source.{column}'
+                                for column in values)
+                    + f' FROM (SELECT DISTINCT ON ({key}) * '
+                    f'FROM import_rows ORDER BY {key}) AS source '
+                    f'WHERE target.{key} = source.{key} '
+                    f'AND target.{pk} = (SELECT MIN(first.{pk}) '
+                    f'FROM {table} AS first '
+                    f'WHERE first.{key} = source.{key}) '
+                    f'AND NOT EXISTS (SELECT 1 FROM {table} AS same '
+                    f'WHERE same.{key} = source.{key} AND {same_values})'
                 )
-        except Exception as e:
-            print(f'Ошибка: {e}. Файл - {json_file}')
+                updated = cursor.rowcount
+            match = (f'same.{key} = source.{key}'
+                     if self.lookup_is_unique
+                     else f'same.{key} = source.{key} AND {same_values}')
+            distinct = (f'DISTINCT ON ({key})'
+                        if upsert or self.lookup_is_unique else 'DISTINCT')
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'SELECT {distinct} {", ".join(columns)} '
+                f'FROM import_rows AS source WHERE NOT EXISTS '
+                f'(SELECT 1 FROM {table} AS same WHERE {match}) '
+                f'ON CONFLICT DO NOTHING'
+            )
+            created = cursor.rowcount
+        self.counts['created'] += created
+        self.counts['updated'] += updated
+        self.counts['skipped'] += len(rows) - created - updated
@@ -6,3 +6,6 @@ from recipes.models import Ingredient
 class Command(BaseImportCommand):
     """Команда для заполнения БД ингредиентами из файла формата JSON"""
     model = Ingredient
+    version_name = 'ingredients'
+    lookup_field = 'name'
+    update_fields = ('measurement_unit',)
@@ -6,3 +6,6 @@ from recipes.models import Tag
 class Command(BaseImportCommand):
     """Команда для заполнения БД тэгами из файла формата JSON"""
     model = Tag
+    version_name = 'tags'
+    lookup_field = 'slug'
+    update_fields = ('name',)
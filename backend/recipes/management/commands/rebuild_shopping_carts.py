@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartIngredient
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Команда для пересчета или проверки сумм продуктов в корзинах"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare stored totals with the carts')
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Limit the command to the given user ids')
+
+    def handle(self, **options):
+        user_ids = options['user_ids']
+        if options['verify']:
+            return self.verify(user_ids)
+        with transaction.atomic():
+            created = ShoppingCartIngredient.objects.rebuild(
+                user_ids, batch_size=BATCH_SIZE
+            )
+        self.stdout.write(f'Суммы продуктов в корзинах пересчитаны '
+                          f'({len(created)})')
+
+    def verify(self, user_ids):
+        expected = ShoppingCartIngredient.objects.calculate(user_ids)
+        stored = ShoppingCartIngredient.objects.order_by()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in stored.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        }
+        mismatches = sorted(
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        )
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f'Пользователь {user_id}, продукт {ingredient_id}: '
+                f'ожидается {expected.get((user_id, ingredient_id))}, '
+                f'сохранено {stored.get((user_id, ingredient_id))}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write('Суммы продуктов в корзинах совпадают')
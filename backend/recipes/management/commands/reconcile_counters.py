@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Follow, FoodgramUser, Recipe
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (FoodgramUser, 'recipes_count', Recipe, 'author'),
+    (FoodgramUser, 'subscribers_count', Follow, 'author'),
+    (FoodgramUser, 'subscriptions_count', Follow, 'user'),
+)
+
+
+class Command(BaseCommand):
+    """Команда для сверки и исправления счетчиков рецептов и подписок"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report counters that have drifted')
+
+    def handle(self, **options):
+        drifted = 0
+        for model, counter, related_model, related_field in COUNTERS:
+            actual = Coalesce(
+                Subquery(
+                    related_model.objects.filter(
+                        **{related_field: OuterRef('pk')}
+                    ).order_by().values(related_field).annotate(
+                        total=Count('pk')
+                    ).values('total'),
+                    output_field=IntegerField()
+                ),
+                0
+            )
+            drifted_objects = model.objects.exclude(**{counter: actual})
+            for obj in drifted_objects.annotate(actual=actual).only(
+                'pk', counter
+            ):
+                self.stdout.write(
+                    f'{model._meta.verbose_name} {obj.pk}, {counter}: '
+                    f'сохранено {getattr(obj, counter)}, '
+                    f'ожидается {obj.actual}'
+                )
+                drifted += 1
+            if not options['verify']:
+                # Счетчик пересчитывается в самом UPDATE, поэтому
+                # одновременные изменения через F() не теряются.
+                drifted_objects.update(**{counter: actual})
+        if not options['verify']:
+            self.stdout.write(f'Счетчики пересчитаны ({drifted})')
+        elif drifted:
+            raise CommandError(f'Расхождений: {drifted}')
+        else:
+            self.stdout.write('Счетчики совпадают')
@@ -0,0 +1,57 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recipes.jobs import work
+
+
+class Command(BaseCommand):
+    """Команда для запуска обработчиков очереди фоновых задач"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.JOBS_WORKERS,
+                            help='Number of workers')
+        parser.add_argument('--mode', choices=('thread', 'process'),
+                            default=settings.JOBS_WORKER_MODE,
+                            help='Run workers in threads or processes')
+        parser.add_argument('--poll-interval', type=float,
+                            default=settings.JOBS_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty')
+
+    def handle(self, **options):
+        if options['mode'] == 'process':
+            stop = multiprocessing.Event()
+            worker_class = multiprocessing.Process
+            # Соединения с БД не должны наследоваться процессами.
+            connections.close_all()
+        else:
+            stop = threading.Event()
+            worker_class = threading.Thread
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        workers = [
+            worker_class(
+                target=work,
+                args=(stop, options['poll_interval'], options['once'])
+            )
+            for _ in range(options['workers'])
+        ]
+        self.stdout.write(
+            f'Запущено обработчиков: {len(workers)} ({options["mode"]})'
+        )
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        self.stdout.write('Обработчики остановлены')
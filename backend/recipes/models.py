@@ -1,7 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import F, Sum, UniqueConstraint
+from django.utils import timezone
 
 USERNAME_MAX_LENGTH = 150
 FIST_NAME_MAX_LENGTH = 150
@@ -19,9 +20,34 @@ COOKING_TIME_MIN = 1
 MAX_REPR_LENGTH_TAG_INGREDIENT = 40
 MAX_REPR_LENGTH_RECIPE = 20
 MIN_AMOUNT = 1
-
-
-class FoodgramUser(AbstractUser):
+JOB_NAME_MAX_LENGTH = 64
+JOB_KEY_MAX_LENGTH = 255
+JOB_STATUS_MAX_LENGTH = 16
+JOB_MAX_ATTEMPTS = 3
+VERSION_NAME_MAX_LENGTH = 64
+
+
+class CountersMixin:
+    """Исключение полей-счетчиков из обычного сохранения объекта.
+
+    Счетчики меняются атомарными UPDATE с F(), поэтому сохранение
+    объекта с устаревшими значениями счетчиков их не перезаписывает.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class FoodgramUser(CountersMixin, AbstractUser):
     """Модель пользователя сервиса FOODGRAM"""
     username = models.CharField(
         max_length=USERNAME_MAX_LENGTH,
@@ -44,9 +70,28 @@ class FoodgramUser(AbstractUser):
         null=True,
         upload_to='users/avatars/',
         verbose_name='Аватар')
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов')
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков')
+    subscriptions_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписок')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    counter_fields = (
+        'recipes_count', 'subscribers_count', 'subscriptions_count'
+    )
+    # Поля, которые входят в кэшированные представления автора.
+    represented_fields = (
+        'email', 'username', 'first_name', 'last_name', 'avatar'
+    )
 
     class Meta:
         ordering = ('email', )
@@ -56,6 +101,38 @@ class FoodgramUser(AbstractUser):
     def __str__(self):
         return self.username[:MAX_STR_VALUE_LENGTH]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        if set(cls.represented_fields) <= set(field_names):
+            user._loaded_values = user.get_represented_values()
+        return user
+
+    def get_represented_values(self):
+        return {
+            name: self._meta.get_field(name).get_prep_value(
+                getattr(self, name)
+            )
+            for name in self.represented_fields
+        }
+
+    def represented_fields_changed(self, update_fields=None):
+        """Изменились ли при сохранении поля представления автора.
+
+        Значения сравниваются с загруженными из БД или сохраненными
+        последними. Для нового пользователя и пользователя
+        с отложенными полями считаются измененными.
+        """
+        if update_fields is not None and not (
+            set(update_fields) & set(self.represented_fields)
+        ):
+            return False
+        loaded_values = getattr(self, '_loaded_values', None)
+        if set(self.represented_fields) & self.get_deferred_fields():
+            return True
+        self._loaded_values = self.get_represented_values()
+        return self._loaded_values != loaded_values
+
 
 class Follow(models.Model):
     """Модель для описания подписки на пользователя"""
@@ -121,12 +198,16 @@ class Ingredient(models.Model):
             fields=['name', 'measurement_unit'],
             name='unique_name_measurement_unit')
         ]
+        indexes = [models.Index(
+            fields=['measurement_unit'],
+            name='ingredient_unit_idx')
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
     """Модель для описания рецепта"""
     author = models.ForeignKey(
         FoodgramUser,
@@ -154,12 +235,30 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата и время создания рецепта'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество добавлений в избранное'
+    )
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         ordering = ('-created_at',)
         default_related_name = 'recipes'
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_idx'),
+            models.Index(
+                fields=['author', '-created_at'],
+                name='recipe_author_created_at_idx'),
+            models.Index(
+                fields=['cooking_time', '-created_at'],
+                name='recipe_cooking_time_idx'),
+        ]
 
     def __str__(self):
         return self.name[:MAX_REPR_LENGTH_RECIPE]
@@ -187,6 +286,31 @@ class RecipeIngredient(models.Model):
         verbose_name = 'Продукт для рецепта'
         verbose_name_plural = 'Продукты для рецептов'
         default_related_name = 'recipeingredients'
+        indexes = [models.Index(
+            fields=['ingredient', 'recipe'],
+            name='recipeingredient_ingr_idx')
+        ]
+
+
+class RecipeSearchEntry(models.Model):
+    """Запись полнотекстового индекса рецептов в SQLite (FTS5).
+
+    Таблицу и триггеры создает recipes.search, модель нужна только
+    для соединения рецептов с индексом в запросах поиска. Поле
+    document - скрытый столбец FTS5 с именем таблицы.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_column='rowid',
+        related_name='search_entry')
+    document = models.TextField(db_column='recipes_recipe_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_fts'
 
 
 class RecipeUserBaseModel(models.Model):
@@ -228,3 +352,210 @@ class ShoppingCart(RecipeUserBaseModel):
     class Meta(RecipeUserBaseModel.Meta):
         verbose_name = 'Рецепт в корзине'
         verbose_name_plural = 'Рецепты в корзине'
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    """Поддержка сумм продуктов в корзинах пользователей"""
+
+    def change_amounts(self, user_ids, amounts):
+        """Изменение сумм продуктов {id продукта: изменение} у пользователей"""
+        amounts = {ingredient_id: amount
+                   for ingredient_id, amount in amounts.items() if amount}
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            (self.model(user_id=user_id, ingredient_id=ingredient_id, amount=0)
+             for user_id in user_ids for ingredient_id in amounts),
+            ignore_conflicts=True
+        )
+        ingredients_by_amount = {}
+        for ingredient_id, amount in amounts.items():
+            ingredients_by_amount.setdefault(amount, []).append(ingredient_id)
+        for amount, ingredient_ids in ingredients_by_amount.items():
+            self.filter(
+                user_id__in=user_ids, ingredient_id__in=ingredient_ids
+            ).update(amount=F('amount') + amount)
+        self.filter(
+            user_id__in=user_ids, ingredient_id__in=amounts, amount__lte=0
+        ).delete()
+
+    def add_recipe(self, user_ids, recipe_id, sign=1):
+        """Добавление продуктов рецепта в корзины пользователей"""
+        self.change_amounts(user_ids, {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in RecipeIngredient.objects.filter(
+                recipe_id=recipe_id
+            ).order_by().values_list('ingredient_id', 'amount')
+        })
+
+    def remove_recipe(self, user_ids, recipe_id):
+        """Удаление продуктов рецепта из корзин пользователей"""
+        self.add_recipe(user_ids, recipe_id, sign=-1)
+
+    def change_recipe_amounts(self, recipe_id, amounts):
+        """Изменение сумм продуктов в корзинах с рецептом recipe_id"""
+        self.change_amounts(
+            list(ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True)),
+            amounts
+        )
+
+    def calculate(self, user_ids=None):
+        """Суммы продуктов корзин, рассчитанные по рецептам в корзинах"""
+        carts = ShoppingCart.objects.order_by()
+        if user_ids is not None:
+            carts = carts.filter(user_id__in=user_ids)
+        return {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in carts.values_list(
+                'user_id', 'recipe__recipeingredients__ingredient_id'
+            ).annotate(
+                amount=Sum('recipe__recipeingredients__amount')
+            )
+            if ingredient_id is not None
+        }
+
+    def rebuild(self, user_ids=None, batch_size=None):
+        """Пересчет сумм продуктов корзин по рецептам в корзинах"""
+        stored = self.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored.delete()
+        totals = self.calculate(user_ids)
+        return self.bulk_create(
+            (self.model(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount
+            ) for (user_id, ingredient_id), amount in totals.items()),
+            batch_size=batch_size
+        )
+
+    def rebuild_recipe_carts(self, recipe_ids):
+        """Пересчет сумм продуктов в корзинах с рецептами recipe_ids"""
+        user_ids = list(ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True).distinct())
+        if user_ids:
+            self.rebuild(user_ids)
+
+
+class ShoppingCartIngredient(models.Model):
+    """Модель для описания суммы продукта в корзине пользователя"""
+    user = models.ForeignKey(
+        FoodgramUser,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь Foodgram')
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт')
+    amount = models.IntegerField(verbose_name='Количество')
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        ordering = ('user__username', 'ingredient__name')
+        verbose_name = 'Продукт в корзине'
+        verbose_name_plural = 'Продукты в корзине'
+        default_related_name = 'shoppingcartingredients'
+        constraints = [UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_user_shoppingcartingredient')]
+
+    def __str__(self):
+        return (f'{self.ingredient} - {self.amount} '
+                f'в корзине пользователя {self.user.username}')
+
+
+class Job(models.Model):
+    """Модель для описания фоновой задачи"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(
+        max_length=JOB_NAME_MAX_LENGTH,
+        verbose_name='Задача')
+    key = models.CharField(
+        max_length=JOB_KEY_MAX_LENGTH,
+        blank=True,
+        db_index=True,
+        verbose_name='Ключ для исключения повторов')
+    payload = models.JSONField(
+        default=dict,
+        verbose_name='Параметры')
+    user = models.ForeignKey(
+        FoodgramUser,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Пользователь Foodgram')
+    status = models.CharField(
+        max_length=JOB_STATUS_MAX_LENGTH,
+        choices=STATUSES,
+        default=PENDING,
+        verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попытки')
+    max_attempts = models.PositiveSmallIntegerField(
+        default=JOB_MAX_ATTEMPTS,
+        verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Запуск не раньше')
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата и время создания')
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата и время запуска')
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата и время завершения')
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка')
+    result = models.BinaryField(
+        null=True,
+        verbose_name='Результат')
+
+    class Meta:
+        ordering = ('-created_at',)
+        verbose_name = 'фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        default_related_name = 'jobs'
+        indexes = [models.Index(
+            fields=['status', 'run_at'],
+            name='job_status_run_at_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.status})'
+
+
+class VersionCounter(models.Model):
+    """Модель для описания счетчика версии данных"""
+    name = models.CharField(
+        max_length=VERSION_NAME_MAX_LENGTH,
+        unique=True,
+        verbose_name='Данные')
+    value = models.BigIntegerField(
+        default=0,
+        verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'счетчик версии'
+        verbose_name_plural = 'Счетчики версий'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
@@ -0,0 +1,160 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Func, Value
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeSearchEntry
+
+SEARCH_CONFIG = 'russian'
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_INDEX_NAME = 'recipe_search_vector_idx'
+FTS_TABLE = RecipeSearchEntry._meta.db_table
+FTS_WEIGHTS = (10.0, 1.0)
+WORD = re.compile(r'\w+')
+
+
+class Match(Func):
+    """Условие FTS5 document MATCH query"""
+    template = '%(expressions)s'
+    arg_joiner = ' MATCH '
+    output_field = BooleanField()
+
+
+class BM25(Func):
+    """Релевантность FTS5, чем больше, тем лучше"""
+    function = 'bm25'
+    template = '-%(function)s(%(expressions)s)'
+    output_field = FloatField()
+
+
+class PostgresRecipeSearch:
+    """Поиск по хранимому tsvector с GIN-индексом.
+
+    Колонка search_vector вычисляется СУБД (GENERATED ... STORED),
+    поэтому остается актуальной при любой записи рецепта.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = connection.ops.quote_name(Recipe._meta.db_table)
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS '
+                f'{SEARCH_VECTOR_COLUMN} tsvector GENERATED ALWAYS AS ('
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', name), 'A') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', text), 'B')"
+                f') STORED'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} '
+                f'ON {self.table} USING gin ({SEARCH_VECTOR_COLUMN})'
+            )
+
+    def search(self, recipes, query):
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        column = f'{self.table}.{SEARCH_VECTOR_COLUMN}'
+        return recipes.filter(RawSQL(
+            f'{column} @@ {tsquery}', (query,), output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank({column}, {tsquery})', (query,),
+            output_field=FloatField()
+        ))
+
+
+class SqliteRecipeSearch:
+    """Поиск по теневой таблице FTS5.
+
+    Таблица хранит только индекс названий и описаний и обновляется
+    триггерами. Морфологии FTS5 не знает, поэтому слова запроса ищутся
+    как префиксы, а "ё" заменяется на "е" и в индексе, и в запросе.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = connection.ops.quote_name(Recipe._meta.db_table)
+
+    @staticmethod
+    def normalize(column):
+        return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+    def values(self, row):
+        return (f'{row}.id, {self.normalize(f"{row}.name")}, '
+                f'{self.normalize(f"{row}.text")}')
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                'AND name = %s', (FTS_TABLE,)
+            )
+            created = cursor.fetchone() is None
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f"USING fts5(name, text, content='', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            delete_old = (
+                f'INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, text) '
+                f"VALUES ('delete', {self.values('old')});"
+            )
+            insert_new = (f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                          f"VALUES ({self.values('new')});")
+            # Триггеры пропадают, когда миграция пересоздает таблицу.
+            for action, statements in (
+                ('INSERT', insert_new),
+                ('UPDATE', delete_old + insert_new),
+                ('DELETE', delete_old),
+            ):
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_{action} '
+                    f'AFTER {action} ON {self.table} '
+                    f'BEGIN {statements} END'
+                )
+            if created:
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                    f"SELECT {self.values(self.table)} FROM {self.table}"
+                )
+
+    def search(self, recipes, query):
+        words = WORD.findall(query.replace('ё', 'е').replace('Ё', 'Е'))
+        if not words:
+            return recipes.annotate(
+                search_rank=Value(0.0, output_field=FloatField())
+            ).none()
+        match = ' '.join(f'"{word}"*' for word in words)
+        document = F('search_entry__document')
+        # bm25 считается в соединении с FTS-таблицей: в подзапросе
+        # для каждой строки MATCH выполнялся бы заново.
+        return recipes.filter(
+            Match(document, Value(match)), search_entry__isnull=False
+        ).annotate(
+            search_rank=BM25(document, *map(Value, FTS_WEIGHTS))
+        )
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresRecipeSearch,
+    'sqlite': SqliteRecipeSearch,
+}
+
+
+def get_search_backend(using='default'):
+    connection = connections[using]
+    return SEARCH_BACKENDS[connection.vendor](connection)
+
+
+def install_search_index(using='default'):
+    """Создание полнотекстового индекса рецептов для текущей СУБД"""
+    if connections[using].vendor in SEARCH_BACKENDS:
+        get_search_backend(using).install()
+
+
+def search_recipes(recipes, query):
+    """Рецепты, найденные по названию и описанию, по убыванию релевантности"""
+    return get_search_backend(recipes.db).search(recipes, query).order_by(
+        '-search_rank', *Recipe._meta.ordering
+    )
@@ -0,0 +1,202 @@
+import threading
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_migrate, post_save, pre_delete
+)
+from django.dispatch import Signal, receiver
+
+from recipes.models import (
+    Favorite, Follow, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, ShoppingCartIngredient, Tag
+)
+from recipes.search import install_search_index
+from recipes.tasks import enqueue_image_variants
+from recipes.versions import (
+    bump_version, cart_version_name, increment_version,
+    recipe_version_name, user_version_name
+)
+
+RECIPE_INGREDIENTS_VERSION = 'recipe_ingredients'
+
+recipe_ingredients_changed = Signal()
+
+changed_recipes = threading.local()
+deleted_cart_owners = threading.local()
+
+
+def send_recipe_ingredients_changed(recipe_ids):
+    """Уведомление об изменении состава рецептов после фиксации транзакции.
+
+    Рецепты, измененные в одной транзакции, отправляются одним
+    сигналом. Получатели узнают версию состава до и после изменения,
+    чтобы применить его точечно, только если видели предыдущую версию.
+    """
+    pending = changed_recipes.__dict__.setdefault('recipe_ids', set())
+    pending.update(recipe_ids)
+    transaction.on_commit(send_pending_recipe_ingredients_changed)
+
+
+def send_pending_recipe_ingredients_changed():
+    # Все функции on_commit транзакции, кроме первой, находят пустое
+    # множество. Рецепты из отмененной транзакции уходят со следующей,
+    # лишнее обновление индекса безвредно.
+    recipe_ids = changed_recipes.__dict__.pop('recipe_ids', None)
+    if not recipe_ids:
+        return
+    version = increment_version(RECIPE_INGREDIENTS_VERSION)
+    recipe_ingredients_changed.send(
+        sender=Recipe,
+        recipe_ids=sorted(recipe_ids),
+        previous_version=version - 1,
+        version=version
+    )
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    bump_version('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    bump_version('tags')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    bump_version(recipe_version_name(instance.id))
+    bump_version('recipes')
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(instance, **kwargs):
+    bump_version(recipe_version_name(instance.recipe_id))
+    send_recipe_ingredients_changed([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    for recipe_id in (pk_set or ()) if reverse else (instance.id,):
+        bump_version(recipe_version_name(recipe_id))
+
+
+@receiver(post_save, sender=FoodgramUser)
+def user_changed(instance, update_fields=None, **kwargs):
+    # Вход пользователя (last_login) и смена пароля не меняют
+    # представления автора в кэшированных рецептах.
+    if instance.represented_fields_changed(update_fields):
+        bump_version(user_version_name(instance.id))
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def shopping_cart_changed(instance, **kwargs):
+    bump_version(cart_version_name(instance.user_id))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(instance, **kwargs):
+    """Удаление продуктов рецепта из всех корзин одним пересчетом.
+
+    Записи корзин с рецептом удаляются каскадом после этого, их
+    получатель post_delete суммы уже не меняет.
+    """
+    ShoppingCartIngredient.objects.remove_recipe(
+        list(instance.shoppingcarts.values_list('user_id', flat=True)),
+        instance.id
+    )
+    deleted_cart_owners.__dict__.setdefault('recipe_ids', set()).add(
+        instance.id
+    )
+
+
+@receiver(pre_delete, sender=FoodgramUser)
+def user_deleting(instance, **kwargs):
+    # Суммы продуктов корзины пользователя удаляются каскадом.
+    deleted_cart_owners.__dict__.setdefault('user_ids', set()).add(
+        instance.id
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    deleted_cart_owners.__dict__.get('recipe_ids', set()).discard(
+        instance.id
+    )
+
+
+@receiver(post_delete, sender=FoodgramUser)
+def user_deleted(instance, **kwargs):
+    deleted_cart_owners.__dict__.get('user_ids', set()).discard(instance.id)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_saved(instance, created, **kwargs):
+    # Изменение существующих записей корзины пересчитывает админка.
+    if created:
+        ShoppingCartIngredient.objects.add_recipe(
+            [instance.user_id], instance.recipe_id
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(instance, **kwargs):
+    if instance.recipe_id in deleted_cart_owners.__dict__.get(
+        'recipe_ids', ()
+    ) or instance.user_id in deleted_cart_owners.__dict__.get(
+        'user_ids', ()
+    ):
+        return
+    ShoppingCartIngredient.objects.remove_recipe(
+        [instance.user_id], instance.recipe_id
+    )
+
+
+def change_counter(model, pk, counter, signal):
+    """Атомарное изменение счетчика при создании или удалении связи"""
+    model.objects.filter(pk=pk).update(
+        **{counter: F(counter) + (1 if signal is post_save else -1)}
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_count_changed(instance, signal, created=True, **kwargs):
+    if created:
+        change_counter(FoodgramUser, instance.author_id,
+                       'recipes_count', signal)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def favorite_count_changed(instance, signal, created=True, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', signal)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def follow_count_changed(instance, signal, created=True, **kwargs):
+    if created:
+        change_counter(FoodgramUser, instance.author_id,
+                       'subscribers_count', signal)
+        change_counter(FoodgramUser, instance.user_id,
+                       'subscriptions_count', signal)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, update_fields=None, **kwargs):
+    if update_fields is None or 'image' in update_fields:
+        enqueue_image_variants(instance.image)
+
+
+@receiver(post_save, sender=FoodgramUser)
+def avatar_saved(instance, update_fields=None, **kwargs):
+    if update_fields is None or 'avatar' in update_fields:
+        enqueue_image_variants(instance.avatar)
+
+
+@receiver(post_migrate)
+def search_index_installed(sender, using, **kwargs):
+    if sender.label == Recipe._meta.app_label:
+        install_search_index(using)
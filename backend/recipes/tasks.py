@@ -0,0 +1,61 @@
+from django.apps import apps
+
+from recipes.images import (
+    get_variant_names, has_image_variants, update_image_variants
+)
+from recipes.jobs import enqueue, task
+from recipes.versions import (
+    bump_version, recipe_version_name, user_version_name
+)
+
+IMAGE_VERSION_NAMES = {
+    'recipes.recipe': recipe_version_name,
+    'recipes.foodgramuser': user_version_name,
+}
+
+
+@task('generate_image_variants')
+def generate_image_variants(model, field, name):
+    model_field = apps.get_model(model)._meta.get_field(field)
+    update_image_variants(model_field.attr_class(None, model_field, name))
+    image_variants_generated(model, field, name)
+
+
+def image_variants_generated(model, field, name):
+    """Смена версий объектов с изображением после создания копий,
+    чтобы кэшированные представления получили ссылки на копии"""
+    for pk in apps.get_model(model).objects.filter(
+        **{field: name}
+    ).values_list('pk', flat=True):
+        bump_version(IMAGE_VERSION_NAMES[model](pk))
+
+
+@task('delete_image')
+def delete_image(model, field, name):
+    """Удаление изображения и его копий, если на него нет ссылок"""
+    model = apps.get_model(model)
+    if model.objects.filter(**{field: name}).exists():
+        return
+    storage = model._meta.get_field(field).storage
+    for file_name in (name, *get_variant_names(name)):
+        storage.delete(file_name)
+
+
+def get_image_payload(image):
+    return {
+        'model': image.instance._meta.label_lower,
+        'field': image.field.name,
+        'name': image.name
+    }
+
+
+def enqueue_image_variants(image):
+    """Постановка в очередь создания копий нового изображения"""
+    if image and not has_image_variants(image.name, image.storage):
+        enqueue('generate_image_variants', get_image_payload(image),
+                key=f'image_variants:{image.name}')
+
+
+def enqueue_image_deletion(image):
+    if image:
+        enqueue('delete_image', get_image_payload(image))
@@ -0,0 +1,71 @@
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+from recipes.models import VersionCounter
+
+VERSIONS_CACHE = 'versions'
+VERSION_KEY = 'version:{name}'
+
+
+def get_version(name):
+    """Метка версии данных - время их последнего изменения"""
+    return get_versions([name])[name]
+
+
+def get_versions(names):
+    """Метки версий нескольких наборов данных за одно обращение к кэшу"""
+    cache = caches[VERSIONS_CACHE]
+    keys = {VERSION_KEY.format(name=name): name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, int(time.time()), None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_version(name):
+    """Смена версии данных после их изменения"""
+    version = time.time()
+    caches[VERSIONS_CACHE].set(VERSION_KEY.format(name=name), version, None)
+    return version
+
+
+def get_version_counter(name):
+    """Текущее значение счетчика версии из БД"""
+    return VersionCounter.objects.filter(name=name).values_list(
+        'value', flat=True
+    ).first() or 0
+
+
+def increment_version(name):
+    """Атомарная смена счетчика версии в БД.
+
+    Строка счетчика заблокирована обновлением до конца транзакции,
+    поэтому одновременные изменения из разных процессов получают
+    разные версии, а предыдущая всегда на единицу меньше новой.
+    """
+    counters = VersionCounter.objects.filter(name=name)
+    with transaction.atomic():
+        if not counters.update(value=F('value') + 1):
+            counter, created = VersionCounter.objects.get_or_create(
+                name=name, defaults={'value': 1}
+            )
+            if created:
+                return counter.value
+            counters.update(value=F('value') + 1)
+        return counters.values_list('value', flat=True).get()
+
+
+def recipe_version_name(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_version_name(user_id):
+    return f'user:{user_id}'
+
+
+def cart_version_name(user_id):
+    return f'cart:{user_id}'